@@ -18,10 +18,14 @@ CREATE TABLE IF NOT EXISTS user_locations (
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     latitude DECIMAL(10, 8) NOT NULL,
     longitude DECIMAL(11, 8) NOT NULL,
+    cell_id BIGINT,
     last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(user_id)
 );
 
+-- Proximity grid cell (see spatial_index.cell_to_id), for databases created before it existed
+ALTER TABLE user_locations ADD COLUMN IF NOT EXISTS cell_id BIGINT;
+
 -- Friends table
 CREATE TABLE IF NOT EXISTS friends (
     id SERIAL PRIMARY KEY,
@@ -45,6 +49,10 @@ CREATE TABLE IF NOT EXISTS password_reset_tokens (
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_user_locations_user_id ON user_locations(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_locations_coords ON user_locations(latitude, longitude);
+CREATE INDEX IF NOT EXISTS idx_user_locations_cell ON user_locations(cell_id, last_updated) INCLUDE (latitude, longitude, user_id);
 CREATE INDEX IF NOT EXISTS idx_users_active ON users(is_active);
 CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_token ON password_reset_tokens(token);
 CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_user_id ON password_reset_tokens(user_id);
+-- Expiry indexes for the maintenance purges (see maintenance.py)
+CREATE INDEX IF NOT EXISTS idx_user_locations_last_updated ON user_locations(last_updated);
+CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_expires_at ON password_reset_tokens(expires_at);
@@ -0,0 +1,103 @@
+"""
+Admission control for HTTP routes and socket events
+Work is grouped into route classes, each with its own in-flight limit, and all
+classes share one overall budget. Part of that budget is held back for
+location:update so auth bursts can't starve live location traffic.
+Rejections are immediate so an overloaded worker answers fast instead of
+queueing until everything times out.
+"""
+import os
+import threading
+from functools import wraps
+from typing import Callable, Dict
+
+from flask import jsonify
+
+AUTH = 'auth'
+PROFILE = 'profile'
+SOCKET = 'socket'
+LOCATION = 'location'
+
+RETRY_AFTER_SECONDS = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+
+
+class AdmissionController:
+    """
+    Tracks in-flight work per route class
+    A class may use the shared budget only as far as it leaves the unused
+    reservations of other classes untouched
+    """
+
+    def __init__(self, total: int, limits: Dict[str, int], reserved: Dict[str, int]):
+        self.total = total
+        self.limits = limits
+        self.reserved = reserved
+        self.lock = threading.Lock()
+        self.in_flight = {route_class: 0 for route_class in limits}
+        self.admitted = {route_class: 0 for route_class in limits}
+        self.rejected = {route_class: 0 for route_class in limits}
+
+    def try_acquire(self, route_class: str) -> bool:
+        with self.lock:
+            if self.in_flight[route_class] >= self.limits[route_class]:
+                self.rejected[route_class] += 1
+                return False
+
+            held_for_others = sum(
+                max(0, reserved - self.in_flight[other])
+                for other, reserved in self.reserved.items() if other != route_class
+            )
+            if sum(self.in_flight.values()) + held_for_others >= self.total:
+                self.rejected[route_class] += 1
+                return False
+
+            self.in_flight[route_class] += 1
+            self.admitted[route_class] += 1
+            return True
+
+    def release(self, route_class: str) -> None:
+        with self.lock:
+            self.in_flight[route_class] -= 1
+
+    def limit(self, route_class: str, on_reject: Callable):
+        """
+        Decorator that runs the handler only if admitted, otherwise returns on_reject()
+        """
+        def decorator(handler):
+            @wraps(handler)
+            def wrapper(*args, **kwargs):
+                if not self.try_acquire(route_class):
+                    return on_reject()
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    self.release(route_class)
+            return wrapper
+        return decorator
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'total': self.total,
+                'in_flight': dict(self.in_flight),
+                'admitted': dict(self.admitted),
+                'rejected': dict(self.rejected),
+            }
+
+
+def overloaded_response():
+    """Fast 503 for shed HTTP requests"""
+    return jsonify({'error': 'Server is busy. Please try again shortly.'}), 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
+
+
+# Global admission controller
+admission = AdmissionController(
+    int(os.getenv('ADMISSION_TOTAL', 128)),
+    {
+        AUTH: int(os.getenv('ADMISSION_AUTH_LIMIT', 16)),
+        PROFILE: int(os.getenv('ADMISSION_PROFILE_LIMIT', 32)),
+        SOCKET: int(os.getenv('ADMISSION_SOCKET_LIMIT', 64)),
+        LOCATION: int(os.getenv('ADMISSION_LOCATION_LIMIT', 128)),
+    },
+    {LOCATION: int(os.getenv('ADMISSION_LOCATION_RESERVED', 32))},
+)
@@ -3,18 +3,105 @@ from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_mail import Mail, Message
 import os
+import time
 from dotenv import load_dotenv
 from database import db
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from auth import register_user, login_user, get_user_profile, update_user_headline, update_user_avatar, update_user_pronouns, update_user_activity, verify_jwt_token, request_password_reset, verify_reset_token, reset_password
-from location import update_user_location, delete_user_location, get_nearby_active_users
+from auth import purge_expired_reset_tokens, register_user, login_user, get_user_profile, get_profiles, update_user_profile, update_user_headline, update_user_avatar, update_user_pronouns, update_user_activity, verify_jwt_token, decode_jwt_token, request_password_reset, verify_reset_token, reset_password
+from location import PURGE_BATCH_SIZE, presence_expiry, purge_stale_locations, update_user_location, delete_user_location, update_proximity_graph, build_nearby_payloads, location_store, spatial_index, presence
+from broadcast_scheduler import BroadcastScheduler
+from nearby_diff import build_nearby_diff, request_resync
+from wire_format import decode_location_update, encode_nearby_users, position_entry, positions_only, unsent_profiles
+from sessions import sessions
+from user_cache import user_cache, profile_version
+from password_hasher import password_hasher
+from ingest_throttle import check_update, record_accepted, pending_delay, take_pending, parse_client_timestamp, DEFER, DROP
+from maintenance import MaintenanceScheduler
+import json_codec
+from json_codec import FastJSONProvider, nearby_entry, profile_fragment, fragment_cache
+from admission import admission, overloaded_response, AUTH, PROFILE, SOCKET, LOCATION
 
 load_dotenv()
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# A message queue (e.g. redis://) lets several workers/nodes emit to each other's sockets
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=os.getenv('SOCKETIO_MESSAGE_QUEUE'), json=json_codec)
+
+# Flush batched location writes (or snapshot the in-memory store) in the background
+socketio.start_background_task(location_store.run, socketio.sleep)
+
+def send_nearby_users(user_id, nearby_users):
+    session = sessions.for_user(user_id)
+    
+    # Diff subscribers only get what changed since their last message
+    if session and session.protocol == 'diff':
+        diff = build_nearby_diff(session, nearby_users)
+        if diff is None:
+            return
+        diff['entered'] = [nearby_entry(user) for user in diff['entered']]
+        socketio.emit('location:nearby-diff', diff, room=session.sid)
+    elif session and session.encoding == 'binary':
+        # Binary clients get each profile once, then ids + coordinates only
+        profiles = unsent_profiles(session, nearby_users)
+        if profiles:
+            socketio.emit('location:profiles', [profile_fragment(profile) for profile in profiles], room=session.sid)
+        socketio.emit('location:nearby-users', encode_nearby_users(nearby_users), room=session.sid)
+    elif session and session.positions_only:
+        socketio.emit('location:nearby-users', positions_only(nearby_users), room=session.sid)
+    else:
+        # Each neighbor's entry is serialized once and reused across recipients
+        socketio.emit('location:nearby-users', [nearby_entry(user) for user in nearby_users], room=f'location_room_{user_id}')
+    
+    if session:
+        session.last_emit = time.time()
+
+def send_moves(user_id, entries):
+    # One batch per tick of neighbors who moved without entering or leaving the radius
+    session = sessions.for_user(user_id)
+    if session and session.positions_only:
+        socketio.emit('location:moved', entries, room=session.sid)
+        session.last_emit = time.time()
+
+def build_local_payloads(user_ids):
+    # Each worker only builds views for the sockets it owns
+    return build_nearby_payloads([user_id for user_id in user_ids if sessions.for_user(user_id)])
+
+# Nearby-user broadcasts go out at most once per recipient per tick
+BROADCAST_TICK_SECONDS = float(os.getenv('BROADCAST_TICK_SECONDS', 0.5))
+broadcast_scheduler = BroadcastScheduler(BROADCAST_TICK_SECONDS, build_local_payloads, send_nearby_users, send_moves)
+socketio.start_background_task(broadcast_scheduler.run, socketio.sleep)
+
+def mark_nearby_dirty(user_ids):
+    """
+    Schedule refreshed nearby lists on whichever worker owns each user's socket
+    """
+    presence.publish('nearby-dirty', list(user_ids))
+
+def mark_neighbors_moved(user_ids, entry):
+    """
+    Like mark_nearby_dirty, for neighbors who only saw someone change position
+    entry is the mover's position_entry (only ever sent to these neighbors)
+    """
+    presence.publish('nearby-moved', {'neighbors': list(user_ids), 'entry': entry})
+
+def refresh_moved_neighbors(message):
+    # Positions-mode sockets get the new position in their next location:moved batch
+    sessions_by_user = {user_id: sessions.for_user(user_id) for user_id in message['neighbors']}
+    broadcast_scheduler.queue_moves([
+        user_id for user_id, session in sessions_by_user.items()
+        if session and session.positions_only
+    ], message['entry'])
+    broadcast_scheduler.mark_dirty([
+        user_id for user_id, session in sessions_by_user.items()
+        if session and not session.positions_only
+    ])
+
+presence.subscribe('nearby-dirty', broadcast_scheduler.mark_dirty)
+presence.subscribe('nearby-moved', refresh_moved_neighbors)
+presence.start(socketio.start_background_task)
 
 # Flask-Mail Configuration
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
@@ -27,117 +114,215 @@ app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', os.getenv('
 
 mail = Mail(app)
 
-# Test database connection
+# Test database connection (never shed, so it stays a reliable liveness probe)
 @app.route('/health', methods=['GET'])
 def health_check():
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute('SELECT NOW() as current_time')
-        result = cursor.fetchone()
-        cursor.close()
-        db.return_connection(conn)
+        with db.connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute('SELECT NOW() as current_time')
+            result = cursor.fetchone()
+            cursor.close()
         
         return jsonify({
             'status': 'OK',
             'message': 'Chickalo API is running',
             'database': 'Connected',
-            'timestamp': str(result['current_time'])
+            'timestamp': str(result['current_time']),
+            'pool': db.pool_stats(),
+            'password_hasher': password_hasher.stats(),
+            'admission': admission.stats(),
+            'fragment_cache': fragment_cache.stats()
         })
     except Exception as error:
         return jsonify({
             'status': 'ERROR',
             'message': 'Database connection failed',
-            'error': str(error)
+            'error': str(error),
+            'pool': db.pool_stats(),
+            'password_hasher': password_hasher.stats(),
+            'admission': admission.stats(),
+            'fragment_cache': fragment_cache.stats()
         }), 500
 
 # Authentication routes
 @app.route('/api/auth/register', methods=['POST'])
+@admission.limit(AUTH, overloaded_response)
 def register():
     return register_user()
 
 @app.route('/api/auth/login', methods=['POST'])
+@admission.limit(AUTH, overloaded_response)
 def login():
     return login_user()
 
 @app.route('/api/auth/profile', methods=['GET'])
+@admission.limit(PROFILE, overloaded_response)
 def profile():
     return get_user_profile()
 
+@app.route('/api/auth/profile', methods=['PATCH'])
+@admission.limit(PROFILE, overloaded_response)
+def patch_profile():
+    return update_user_profile()
+
+@app.route('/api/users/profiles', methods=['GET'])
+@admission.limit(PROFILE, overloaded_response)
+def profiles():
+    return get_profiles()
+
 @app.route('/api/auth/update-headline', methods=['PUT'])
+@admission.limit(PROFILE, overloaded_response)
 def update_headline():
     return update_user_headline()
 
 @app.route('/api/auth/update-avatar', methods=['PUT'])
+@admission.limit(PROFILE, overloaded_response)
 def update_avatar():
     return update_user_avatar()
 
 @app.route('/api/auth/update-pronouns', methods=['PUT'])
+@admission.limit(PROFILE, overloaded_response)
 def update_pronouns():
     return update_user_pronouns()
 
 @app.route('/api/auth/update-activity', methods=['PUT'])
+@admission.limit(PROFILE, overloaded_response)
 def update_activity():
     return update_user_activity()
 
 @app.route('/api/auth/forgot-password', methods=['POST'])
+@admission.limit(AUTH, overloaded_response)
 def forgot_password():
     return request_password_reset(mail)
 
 @app.route('/api/auth/verify-reset-token', methods=['POST'])
+@admission.limit(AUTH, overloaded_response)
 def verify_token():
     return verify_reset_token()
 
 @app.route('/api/auth/reset-password', methods=['POST'])
+@admission.limit(AUTH, overloaded_response)
 def reset_password_route():
     return reset_password()
 
-# Store active user sessions (user_id -> socket_id mapping)
-active_users = {}
+def remove_location(user_id):
+    """
+    Delete a user's location and refresh the view of everyone who could see them
+    """
+    former_neighbors = presence.neighbors(user_id)
+    delete_user_location(user_id)
+    mark_nearby_dirty(former_neighbors)
+
+def refuse_connection():
+    raise ConnectionRefusedError('Server is busy')
+
+def reject_join():
+    emit('error', {'message': 'Server is busy, please try again shortly'})
+
+def drop_event():
+    # Dropped updates are superseded by the client's next GPS tick
+    return None
+
+def expire_locations(user_ids):
+    """
+    Evict positions that went stale and refresh their neighbors' views
+    """
+    # Another worker may have written a newer position for a user who reconnected there
+    still_fresh = presence.positions(user_ids)
+    for user_id in user_ids:
+        if user_id in still_fresh:
+            continue
+        # One bad entry must not strand the rest of the batch (their heap entries are already popped)
+        try:
+            session = sessions.for_user(user_id)
+            if session:
+                # Accept the next update straight away
+                session.latitude = session.longitude = session.cell = None
+            remove_location(user_id)
+        except Exception as e:
+            print(f'Error expiring location for user {user_id}: {str(e)}')
+    print(f'Expired {len(user_ids) - len(still_fresh)} stale locations')
+
+def purge_stale_presence():
+    """
+    Sweep shared presence left behind by workers that died, and refresh their
+    former neighbors' views
+    """
+    removed = presence.purge_stale(PURGE_BATCH_SIZE)
+    if removed:
+        mark_nearby_dirty(set().union(*removed.values()) - removed.keys())
+    return len(removed)
+
+# Stale presence is evicted as it expires; dead rows are purged in batches
+MAINTENANCE_PURGE_INTERVAL = float(os.getenv('MAINTENANCE_PURGE_INTERVAL', 300))
+maintenance_scheduler = MaintenanceScheduler(presence_expiry, expire_locations, [
+    (MAINTENANCE_PURGE_INTERVAL, purge_stale_locations),
+    (MAINTENANCE_PURGE_INTERVAL, purge_expired_reset_tokens),
+    (MAINTENANCE_PURGE_INTERVAL, purge_stale_presence),
+])
+socketio.start_background_task(maintenance_scheduler.run, socketio.sleep)
 
 # Socket.io connection handling
 @socketio.on('connect')
-def handle_connect():
-    print(f'User connected: {request.sid}')
+@admission.limit(SOCKET, refuse_connection)
+def handle_connect(auth=None):
+    """
+    Verify the handshake token once and create the socket's session
+    """
+    token = (auth or {}).get('token')
+    user_id, error_message = decode_jwt_token(token)
+    if error_message:
+        print(f'Rejected connection {request.sid}: {error_message}')
+        raise ConnectionRefusedError(error_message)
+    
+    state = user_cache.get(user_id)
+    sessions.create(request.sid, user_id, bool(state and state['is_active']))
+    
+    # Personal room for this user's nearby-user broadcasts
+    join_room(f'location_room_{user_id}')
+    
+    print(f'User {user_id} connected: {request.sid}')
     emit('status', {'message': 'Connected to Chickalo server'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     # Remove user from active tracking on disconnect
-    user_id = None
-    for uid, sid in active_users.items():
-        if sid == request.sid:
-            user_id = uid
-            break
+    session = sessions.remove(request.sid)
     
-    if user_id:
-        del active_users[user_id]
-        delete_user_location(user_id)
-        print(f'User {user_id} disconnected and location removed: {request.sid}')
+    # Keep the location if the user is still connected on another socket
+    if session and session.is_active and not sessions.for_user(session.user_id):
+        remove_location(session.user_id)
+        print(f'User {session.user_id} disconnected and location removed: {request.sid}')
     else:
         print(f'User disconnected: {request.sid}')
 
 @socketio.on('location:join')
-def handle_location_join(data):
+@admission.limit(SOCKET, reject_join)
+def handle_location_join(data=None):
     """
     User joins location tracking (when activity toggle is enabled)
-    Requires authentication token
+    Identity comes from the session created at connect
+    Pass {'protocol': 'diff'} to receive location:nearby-diff instead of full lists,
+    or {'encoding': 'binary'} to use the packed format in wire_format,
+    or {'mode': 'positions'} for nearby lists without profiles (see wire_format),
+    plus location:moved batches of neighbors' new positions
     """
     try:
-        # For Socket.io, we'll store user_id directly in session
-        # Token verification happens during socket connection
-        user_id = data.get('user_id')
-        if not user_id:
-            emit('error', {'message': 'User ID required'})
+        session = sessions.get(request.sid)
+        if not session:
+            emit('error', {'message': 'Not authenticated'})
             return
         
-        # Store user session
-        active_users[user_id] = request.sid
+        user_id = session.user_id
+        session.is_active = True
+        session.protocol = 'diff' if (data or {}).get('protocol') == 'diff' else 'full'
+        session.encoding = 'binary' if (data or {}).get('encoding') == 'binary' else 'json'
+        session.positions_only = (data or {}).get('mode') == 'positions'
+        session.sent_profiles = {}
+        request_resync(session)
         
-        # Join location tracking room
-        join_room('location_tracking')
-        
-        # Also join user's personal room for targeted updates
+        # Join user's personal room for targeted updates
         join_room(f'location_room_{user_id}')
         
         print(f'User {user_id} joined location tracking')
@@ -148,88 +333,131 @@ def handle_location_join(data):
         emit('error', {'message': 'Failed to join location tracking'})
 
 @socketio.on('location:leave')
-def handle_location_leave(data):
+def handle_location_leave(data=None):
     """
     User leaves location tracking (when activity toggle is disabled)
     Removes location from database for privacy
     """
     try:
-        user_id = data.get('user_id')
-        if not user_id:
-            return  # Silently fail if no user_id
+        session = sessions.get(request.sid)
+        if not session:
+            return  # Silently fail if not authenticated
         
-        # Remove from active users
-        if user_id in active_users:
-            del active_users[user_id]
+        user_id = session.user_id
+        session.is_active = False
+        session.latitude = session.longitude = session.cell = None
+        session.pending_update = None
         
-        # Leave location tracking room (wrap in try/catch for safety)
+        # Leave personal room (wrap in try/catch for safety)
         try:
-            leave_room('location_tracking')
             leave_room(f'location_room_{user_id}')
         except:
             pass  # Already left or connection closed
         
         # Delete location from database (privacy)
-        delete_user_location(user_id)
+        remove_location(user_id)
         
         print(f'User {user_id} left location tracking')
         
     except Exception as e:
         print(f'Error in location:leave: {str(e)}')
 
+@socketio.on('location:resync')
+@admission.limit(SOCKET, drop_event)
+def handle_location_resync(data=None):
+    """
+    Diff subscriber asks for a full nearby list on the next tick
+    """
+    session = sessions.get(request.sid)
+    if not session or not session.is_active:
+        return
+    
+    request_resync(session)
+    broadcast_scheduler.mark_dirty([session.user_id])
+
+def ingest_location(session, latitude, longitude, timestamp):
+    """
+    Apply the ingest rules, then store the position and schedule broadcasts
+    """
+    decision = check_update(session, latitude, longitude, timestamp)
+    if decision == DROP:
+        return
+    if decision == DEFER:
+        # One deferred apply per burst; it picks up whichever update arrived last
+        if not session.pending_scheduled:
+            session.pending_scheduled = True
+            socketio.start_background_task(apply_pending_location, session)
+        return
+    
+    user_id = session.user_id
+    
+    # Update user location (skipped entirely if tracking is off for this socket)
+    success = session.is_active and update_user_location(user_id, latitude, longitude)
+    
+    if not success:
+        # User is not active, don't store location
+        try:
+            empty = encode_nearby_users([]) if session.encoding == 'binary' else []
+            socketio.emit('location:nearby-users', empty, room=session.sid)
+        except:
+            pass  # Connection may be closed
+        return
+    
+    record_accepted(session, timestamp)
+    session.latitude, session.longitude = latitude, longitude
+    session.cell = spatial_index.cell_for(latitude, longitude)
+    
+    # Update only the mover's edges in the proximity graph
+    nearby_ids, entered_ids, departed_ids = update_proximity_graph(user_id, latitude, longitude)
+    
+    # Lists whose membership changed are refreshed on the next tick. Neighbors who
+    # only saw the mover shift get the new position in that tick's batch instead;
+    # nearby_ids passed the server-side radius check, so nobody further away does
+    mark_nearby_dirty([user_id, *entered_ids, *departed_ids])
+    moved_ids = nearby_ids - entered_ids
+    if moved_ids:
+        state = user_cache.get(user_id)
+        entry = position_entry(user_id, latitude, longitude, profile_version(state and state['updated_at']))
+        mark_neighbors_moved(moved_ids, entry)
+    
+    print(f'Location updated for user {user_id}: ({latitude}, {longitude}), nearby users: {len(nearby_ids)}')
+
+def apply_pending_location(session):
+    """
+    Background task: apply the latest update of a burst once the interval has passed
+    """
+    try:
+        socketio.sleep(pending_delay(session))
+        session.pending_scheduled = False
+        pending = take_pending(session)
+        # Skip if the socket disconnected or left tracking in the meantime
+        if pending and session.is_active and sessions.get(session.sid) is session:
+            ingest_location(session, *pending)
+    except Exception as e:
+        print(f'Error applying deferred location:update: {str(e)}')
+
 @socketio.on('location:update')
+@admission.limit(LOCATION, drop_event)
 def handle_location_update(data):
     """
     Receive location update from user
     Store in database and broadcast to nearby users
     """
     try:
-        user_id = data.get('user_id')
+        session = sessions.get(request.sid)
+        if isinstance(data, (bytes, bytearray)):
+            data = decode_location_update(data)
         latitude = data.get('latitude')
         longitude = data.get('longitude')
         
-        if not all([user_id, latitude is not None, longitude is not None]):
-            return  # Silently fail if missing data
+        if not session or latitude is None or longitude is None:
+            return  # Silently fail if unauthenticated or missing data
         
-        # Update user location in database
-        success = update_user_location(user_id, latitude, longitude)
-        
-        if not success:
-            # User is not active, don't store location
-            try:
-                emit('location:nearby-users', [])
-            except:
-                pass  # Connection may be closed
-            return
-        
-        # Get nearby active users
-        nearby_users = get_nearby_active_users(user_id, latitude, longitude)
-        
-        # Send nearby users back to the requester
-        try:
-            emit('location:nearby-users', nearby_users)
-        except:
-            pass  # Connection may be closed, don't crash
-        
-        # ALSO notify each nearby user that this user is in their proximity
-        for nearby_user in nearby_users:
-            try:
-                # Get this user's full data to send to nearby user
-                nearby_user_data = get_nearby_active_users(nearby_user['userId'], 
-                                                           nearby_user['latitude'], 
-                                                           nearby_user['longitude'])
-                # Emit to the nearby user's room
-                emit('location:nearby-users', nearby_user_data, 
-                     room=f"location_room_{nearby_user['userId']}")
-            except:
-                pass  # Connection may be closed
-        
-        print(f'Location updated for user {user_id}: ({latitude}, {longitude}), nearby users: {len(nearby_users)}')
+        ingest_location(session, float(latitude), float(longitude), parse_client_timestamp(data.get('timestamp')))
         
     except Exception as e:
         print(f'Error in location:update: {str(e)}')
 
-
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 3000))
     socketio.run(app, host='0.0.0.0', port=port, debug=True)
@@ -1,13 +1,21 @@
-import bcrypt
+import hashlib
 import jwt
 import secrets
 import string
 import re
-from datetime import datetime, timedelta
-from flask import request, jsonify
+from datetime import datetime, timedelta, timezone
+from flask import Response, request, jsonify
 from database import db
+from user_cache import user_cache, profile_version
+from location import invalidate_user_everywhere, notify_user_changed, fetch_active_profiles, presence, PURGE_BATCH_SIZE
+from sessions import sessions
+from password_hasher import password_hasher, PasswordHasherBusy
+import psycopg2.errors
 import psycopg2.extras
 
+# Most profiles GET /api/users/profiles returns per request
+MAX_BULK_PROFILES = 200
+
 def is_valid_email(email):
     """Validate email format using regex"""
     email_regex = r'^[^\s@]+@[^\s@]+\.[^\s@]+$'
@@ -37,12 +45,11 @@ def generate_unique_username():
         username = generate_username()
         
         # Check if username already exists
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-        existing = cursor.fetchone()
-        cursor.close()
-        db.return_connection(conn)
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+            existing = cursor.fetchone()
+            cursor.close()
         
         if not existing:
             return username
@@ -53,12 +60,16 @@ def generate_unique_username():
     return f"{base_username}{timestamp}"
 
 def hash_password(password):
-    """Hash password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """Hash password using bcrypt (on the bounded hashing pool)"""
+    return password_hasher.hash(password)
 
 def verify_password(password, hashed):
-    """Verify password against hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    """Verify password against hash (on the bounded hashing pool)"""
+    return password_hasher.verify(password, hashed)
+
+def hasher_busy_response():
+    """Response for when the password hashing queue is full"""
+    return jsonify({'error': 'Server is busy. Please try again shortly.'}), 503, {'Retry-After': '1'}
 
 def generate_jwt_token(user_id):
     """Generate JWT token for user"""
@@ -68,6 +79,19 @@ def generate_jwt_token(user_id):
     }
     return jwt.encode(payload, 'your-super-secret-jwt-key-change-this-in-production', algorithm='HS256')
 
+def decode_jwt_token(token):
+    """Decode a JWT token and return (user_id, error_message)"""
+    if not token:
+        return None, 'No token provided'
+    
+    try:
+        payload = jwt.decode(token, 'your-super-secret-jwt-key-change-this-in-production', algorithms=['HS256'])
+        return payload['user_id'], None
+    except jwt.ExpiredSignatureError:
+        return None, 'Token expired'
+    except jwt.InvalidTokenError:
+        return None, 'Invalid token'
+
 def verify_jwt_token():
     """Verify JWT token from request headers and return user_id"""
     auth_header = request.headers.get('Authorization')
@@ -76,13 +100,10 @@ def verify_jwt_token():
     
     token = auth_header.split(' ')[1]
     
-    try:
-        payload = jwt.decode(token, 'your-super-secret-jwt-key-change-this-in-production', algorithms=['HS256'])
-        return payload['user_id'], None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({'error': 'Invalid token'}), 401
+    user_id, error_message = decode_jwt_token(token)
+    if error_message:
+        return None, jsonify({'error': error_message}), 401
+    return user_id, None, None
 
 def generate_default_avatar():
     """Generate default avatar data for new users"""
@@ -124,7 +145,8 @@ def format_user_response(user):
         'avatar_data': user['avatar_data'],
         'pronouns': user['pronouns'],
         'is_active': user['is_active'],
-        'created_at': user['created_at'].isoformat()
+        'created_at': user['created_at'].isoformat(),
+        'profile_version': profile_version(user['updated_at'])
     }
 
 def register_user():
@@ -143,32 +165,39 @@ def register_user():
             return jsonify({'error': 'Invalid email format'}), 400
         
         # Check if user already exists
-        conn = db.get_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-        existing_user = cursor.fetchone()
+        with db.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+            existing_user = cursor.fetchone()
+            cursor.close()
         
         if existing_user:
-            cursor.close()
-            db.return_connection(conn)
             return jsonify({'error': 'User with this email already exists'}), 400
         
         # Generate unique username, hash password, and create default avatar
+        # (without holding a pooled connection while bcrypt runs)
         username = generate_unique_username()
         password_hash = hash_password(password)
         default_avatar_data = generate_default_avatar()
         
         # Create user
-        cursor.execute("""
-            INSERT INTO users (email, password_hash, username, headline, avatar_data, pronouns, is_active, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, username, email, headline, avatar_data, pronouns, is_active, created_at
-        """, (email, password_hash, username, headline, psycopg2.extras.Json(default_avatar_data), None, False, datetime.utcnow(), datetime.utcnow()))
-        
-        user = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        db.return_connection(conn)
+        try:
+            with db.connection() as conn:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                cursor.execute("""
+                    INSERT INTO users (email, password_hash, username, headline, avatar_data, pronouns, is_active, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id, username, email, headline, avatar_data, pronouns, is_active, created_at, updated_at
+                """, (email, password_hash, username, headline, psycopg2.extras.Json(default_avatar_data), None, False, datetime.utcnow(), datetime.utcnow()))
+                
+                user = cursor.fetchone()
+                conn.commit()
+                cursor.close()
+        except psycopg2.errors.UniqueViolation as e:
+            # Someone registered the same email while we were hashing
+            if 'email' in (e.diag.constraint_name or ''):
+                return jsonify({'error': 'User with this email already exists'}), 400
+            raise
         
         # Generate JWT token
         token = generate_jwt_token(user['id'])
@@ -179,9 +208,9 @@ def register_user():
             'token': token
         }), 201
         
+    except PasswordHasherBusy:
+        return hasher_busy_response()
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
         print(f"Registration error: {str(e)}")
         return jsonify({'error': 'Registration failed. Please try again.'}), 500
 
@@ -200,12 +229,11 @@ def login_user():
             return jsonify({'error': 'Invalid email format'}), 400
         
         # Find user
-        conn = db.get_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT id, email, password_hash, username, headline, avatar_data, pronouns, is_active, created_at FROM users WHERE email = %s", (email,))
-        user = cursor.fetchone()
-        cursor.close()
-        db.return_connection(conn)
+        with db.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("SELECT id, email, password_hash, username, headline, avatar_data, pronouns, is_active, created_at, updated_at FROM users WHERE email = %s", (email,))
+            user = cursor.fetchone()
+            cursor.close()
         
         if not user or not verify_password(password, user['password_hash']):
             return jsonify({'error': 'Invalid email or password'}), 401
@@ -219,99 +247,197 @@ def login_user():
             'token': token
         }), 200
         
+    except PasswordHasherBusy:
+        return hasher_busy_response()
     except Exception as e:
         print(f"Login error: {str(e)}")
         return jsonify({'error': 'An error occurred. Please try again.'}), 500
 
+def with_profile_validators(response, user):
+    """Attach the ETag for a user's profile version"""
+    response.set_etag(f"{user['id']}-{profile_version(user['updated_at'])}")
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def profile_conditional(response, user):
+    """
+    Turn a profile response into a 304 when If-None-Match still matches
+    Last-Modified is only attached afterwards: HTTP dates stop at whole seconds while
+    profile versions are in milliseconds, so If-Modified-Since would call a second
+    edit within the same second unmodified
+    """
+    response = with_profile_validators(response, user).make_conditional(request)
+    if user['updated_at']:
+        response.last_modified = user['updated_at'].replace(tzinfo=timezone.utc)
+    return response
+
 def get_user_profile():
-    """Get user profile by token"""
+    """Get user profile by token (conditional on If-None-Match)"""
     try:
         user_id, error_response, status_code = verify_jwt_token()
         if error_response:
             return error_response, status_code
         
+        # Answer revalidations from the cached version without touching the database
+        state = user_cache.peek(user_id)
+        if state and request.if_none_match:
+            response = profile_conditional(Response(), state)
+            if response.status_code == 304:
+                return response
+        
         # Get user from database
-        conn = db.get_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT id, username, email, headline, avatar_data, pronouns, is_active, created_at FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        db.return_connection(conn)
+        with db.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("SELECT id, username, email, headline, avatar_data, pronouns, is_active, created_at, updated_at FROM users WHERE id = %s", (user_id,))
+            user = cursor.fetchone()
+            cursor.close()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify({'user': format_user_response(user)}), 200
+        user_cache.put(user)
+        return profile_conditional(jsonify({'user': format_user_response(user)}), user)
         
     except Exception as e:
         print(f"Get profile error: {str(e)}")
         return jsonify({'error': 'An error occurred. Please try again.'}), 500
 
-def update_user_field(field_name, data_key, success_message, error_message="An error occurred. Please try again.", transform_value=None):
-    """Generic function to update any user field"""
+def visible_profile_ids(user_id):
+    """
+    Ids whose profiles a user may fetch: themselves, their current neighbors, and
+    anyone already sent to one of their sockets on this worker
+    """
+    visible = set(presence.neighbors(user_id))
+    visible.add(user_id)
+    for session in sessions.all_for_user(user_id):
+        visible.update(session.sent_profiles)
+        visible.update(session.last_sent or ())
+    return visible
+
+def get_profiles():
+    """
+    Get many active users' profiles by id (?ids=1,2,3), with an ETag over their versions
+    Only users the caller can see nearby are returned; other ids are left out
+    """
     try:
         user_id, error_response, status_code = verify_jwt_token()
         if error_response:
             return error_response, status_code
         
-        # Get new value from request
-        data = request.get_json()
-        value = data.get(data_key)
+        try:
+            ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return jsonify({'error': 'ids must be a comma-separated list of user ids'}), 400
         
-        # Transform value if needed (e.g., for JSON fields)
-        if transform_value:
-            value = transform_value(value)
+        if not ids:
+            return jsonify({'error': 'ids is required'}), 400
+        if len(ids) > MAX_BULK_PROFILES:
+            return jsonify({'error': f'At most {MAX_BULK_PROFILES} ids per request'}), 400
         
-        # Update user field
-        conn = db.get_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute(f"""
-            UPDATE users 
-            SET {field_name} = %s, updated_at = %s 
-            WHERE id = %s
-            RETURNING id, username, email, headline, avatar_data, pronouns, is_active, created_at
-        """, (value, datetime.utcnow(), user_id))
-        
-        user = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        db.return_connection(conn)
+        # Cached state, with every miss loaded in one query
+        visible = visible_profile_ids(user_id)
+        found = fetch_active_profiles(dict.fromkeys(other_id for other_id in ids if other_id in visible))
+        profiles = [found[other_id] for other_id in sorted(found)]
+        
+        versions = ','.join(f"{profile['userId']}:{profile['profile_version']}" for profile in profiles)
+        response = jsonify({'profiles': profiles})
+        response.set_etag(hashlib.sha1(versions.encode('utf-8')).hexdigest())
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+        
+    except Exception as e:
+        print(f"Get profiles error: {str(e)}")
+        return jsonify({'error': 'An error occurred. Please try again.'}), 500
+
+# Fields PATCH /api/auth/profile accepts: field -> (is_valid(value), column value for the UPDATE)
+EDITABLE_PROFILE_FIELDS = {
+    'headline': (lambda value: value is None or isinstance(value, str), lambda value: value),
+    'avatar_data': (lambda value: value is None or isinstance(value, dict), lambda value: psycopg2.extras.Json(value)),
+    'pronouns': (lambda value: value is None or (isinstance(value, str) and len(value) <= 50), lambda value: value),
+    'is_active': (lambda value: isinstance(value, bool), lambda value: value),
+}
+
+def validate_profile_updates(data):
+    """Check a profile update body and return (column values, error_message)"""
+    if not isinstance(data, dict) or not data:
+        return None, 'No profile fields provided'
+    
+    unknown = [field for field in data if field not in EDITABLE_PROFILE_FIELDS]
+    if unknown:
+        return None, f"Unknown profile fields: {', '.join(sorted(unknown))}"
+    
+    updates = {}
+    for field, value in data.items():
+        is_valid, to_column = EDITABLE_PROFILE_FIELDS[field]
+        if not is_valid(value):
+            return None, f'Invalid value for {field}'
+        updates[field] = to_column(value)
+    return updates, None
+
+def update_user_profile(data=None, success_message='Profile updated successfully', error_message="An error occurred. Please try again."):
+    """Apply any subset of profile fields in one statement (PATCH /api/auth/profile)"""
+    try:
+        user_id, error_response, status_code = verify_jwt_token()
+        if error_response:
+            return error_response, status_code
+        
+        if data is None:
+            data = request.get_json(silent=True)
+        updates, validation_error = validate_profile_updates(data)
+        if validation_error:
+            return jsonify({'error': validation_error}), 400
+        
+        # Column names come from EDITABLE_PROFILE_FIELDS, never from the request
+        assignments = ', '.join(f'{field} = %s' for field in updates)
+        with db.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(f"""
+                UPDATE users 
+                SET {assignments}, updated_at = %s 
+                WHERE id = %s
+                RETURNING id, username, email, headline, avatar_data, pronouns, is_active, created_at, updated_at
+            """, (*updates.values(), datetime.utcnow(), user_id))
+            
+            user = cursor.fetchone()
+            conn.commit()
+            cursor.close()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
+        # Keep the location path's cached copy of this user current (one notification per save)
+        user_cache.put(user)
+        notify_user_changed(user['id'])
+        
         return jsonify({
             'message': success_message,
             'user': format_user_response(user)
         }), 200
         
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-        print(f"Update {field_name} error: {str(e)}")
+        print(f"Update profile error: {str(e)}")
         return jsonify({'error': error_message}), 500
 
+def update_user_field(field_name, success_message, error_message="An error occurred. Please try again."):
+    """Update a single profile field (the per-field PUT routes)"""
+    data = request.get_json(silent=True) or {}
+    return update_user_profile({field_name: data.get(field_name)}, success_message, error_message)
+
 def update_user_headline():
     """Update user headline"""
-    return update_user_field('headline', 'headline', 'Headline updated successfully')
+    return update_user_field('headline', 'Headline updated successfully')
 
 def update_user_avatar():
     """Update user avatar data"""
-    return update_user_field(
-        'avatar_data', 
-        'avatar_data', 
-        'Avatar updated successfully',
-        transform_value=lambda x: psycopg2.extras.Json(x)
-    )
+    return update_user_field('avatar_data', 'Avatar updated successfully')
 
 def update_user_pronouns():
     """Update user pronouns"""
-    return update_user_field('pronouns', 'pronouns', 'Pronouns updated successfully')
+    return update_user_field('pronouns', 'Pronouns updated successfully')
 
 def update_user_activity():
     """Update user activity status"""
     return update_user_field(
-        'is_active', 
         'is_active', 
         'Activity status updated successfully',
         'Failed to update activity status.'
@@ -334,16 +460,15 @@ def validate_reset_token(token: str):
     if not token:
         return False, None, 'Token is required'
     
-    conn = db.get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute("""
-        SELECT id, user_id, expires_at, used 
-        FROM password_reset_tokens 
-        WHERE token = %s
-    """, (token,))
-    reset_token = cursor.fetchone()
-    cursor.close()
-    db.return_connection(conn)
+    with db.connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute("""
+            SELECT id, user_id, expires_at, used 
+            FROM password_reset_tokens 
+            WHERE token = %s
+        """, (token,))
+        reset_token = cursor.fetchone()
+        cursor.close()
     
     if not reset_token:
         return False, None, 'Invalid or expired token'
@@ -356,6 +481,30 @@ def validate_reset_token(token: str):
     
     return True, reset_token, None
 
+def purge_expired_reset_tokens(batch_size=PURGE_BATCH_SIZE):
+    """Delete expired reset tokens (used ones included) in small batches, returning the count"""
+    deleted = 0
+    try:
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            while True:
+                # expires_at is written as naive UTC, so compare against UTC rather than NOW()
+                cursor.execute("""
+                    DELETE FROM password_reset_tokens
+                    WHERE id IN (
+                        SELECT id FROM password_reset_tokens
+                        WHERE expires_at < %s
+                        LIMIT %s
+                    )
+                """, (datetime.utcnow(), batch_size))
+                conn.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+    except Exception as e:
+        print(f"Error purging reset tokens: {str(e)}")
+    return deleted
+
 def request_password_reset(mail=None):
     """Request a password reset - generates token and sends email"""
     try:
@@ -370,41 +519,39 @@ def request_password_reset(mail=None):
             return jsonify({'error': 'Invalid email format'}), 400
         
         # Check if user exists
-        conn = db.get_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT id, email, username FROM users WHERE email = %s", (email.strip(),))
-        user = cursor.fetchone()
-        
-        # Always return success message (security: don't reveal if email exists)
-        if not user:
+        with db.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("SELECT id, email, username FROM users WHERE email = %s", (email.strip(),))
+            user = cursor.fetchone()
+        
+            # Always return success message (security: don't reveal if email exists)
+            if not user:
+                cursor.close()
+                return jsonify({'message': 'If an account exists with this email, a password reset link has been sent'}), 200
+        
+            # Generate reset token
+            reset_token = generate_reset_token()
+            expires_at = datetime.utcnow() + timedelta(minutes=15)  # Token expires in 15 minutes
+        
+            # Invalidate all previous unused tokens for this user (only latest token should work)
+            cursor.execute("""
+                UPDATE password_reset_tokens 
+                SET used = %s 
+                WHERE user_id = %s AND used = %s
+            """, (True, user['id'], False))
+        
+            invalidated_count = cursor.rowcount
+            print(f"[PASSWORD RESET] Invalidated {invalidated_count} old tokens for user {user['id']}")
+        
+            # Store new token in database
+            cursor.execute("""
+                INSERT INTO password_reset_tokens (user_id, token, expires_at, used)
+                VALUES (%s, %s, %s, %s)
+            """, (user['id'], reset_token, expires_at, False))
+            conn.commit()
+        
+            print(f"[PASSWORD RESET] Created new token for user {user['id']}, expires at {expires_at}")
             cursor.close()
-            db.return_connection(conn)
-            return jsonify({'message': 'If an account exists with this email, a password reset link has been sent'}), 200
-        
-        # Generate reset token
-        reset_token = generate_reset_token()
-        expires_at = datetime.utcnow() + timedelta(minutes=15)  # Token expires in 15 minutes
-        
-        # Invalidate all previous unused tokens for this user (only latest token should work)
-        cursor.execute("""
-            UPDATE password_reset_tokens 
-            SET used = %s 
-            WHERE user_id = %s AND used = %s
-        """, (True, user['id'], False))
-        
-        invalidated_count = cursor.rowcount
-        print(f"[PASSWORD RESET] Invalidated {invalidated_count} old tokens for user {user['id']}")
-        
-        # Store new token in database
-        cursor.execute("""
-            INSERT INTO password_reset_tokens (user_id, token, expires_at, used)
-            VALUES (%s, %s, %s, %s)
-        """, (user['id'], reset_token, expires_at, False))
-        conn.commit()
-        
-        print(f"[PASSWORD RESET] Created new token for user {user['id']}, expires at {expires_at}")
-        cursor.close()
-        db.return_connection(conn)
         
         # Send email if mail instance is provided
         if mail:
@@ -423,8 +570,6 @@ def request_password_reset(mail=None):
         return jsonify({'message': 'If an account exists with this email, a password reset link has been sent'}), 200
         
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
         print(f"Password reset request error: {str(e)}")
         return jsonify({'error': 'An error occurred. Please try again.'}), 500
 
@@ -469,31 +614,33 @@ def reset_password():
         password_hash = hash_password(new_password)
         
         # Update user's password and mark token as used (transaction)
-        conn = db.get_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        cursor.execute("""
-            UPDATE users 
-            SET password_hash = %s, updated_at = %s 
-            WHERE id = %s
-        """, (password_hash, datetime.utcnow(), reset_token['user_id']))
-        
-        cursor.execute("""
-            UPDATE password_reset_tokens 
-            SET used = %s 
-            WHERE id = %s
-        """, (True, reset_token['id']))
-        
-        conn.commit()
-        cursor.close()
-        db.return_connection(conn)
+        with db.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            
+            cursor.execute("""
+                UPDATE users 
+                SET password_hash = %s, updated_at = %s 
+                WHERE id = %s
+            """, (password_hash, datetime.utcnow(), reset_token['user_id']))
+            
+            cursor.execute("""
+                UPDATE password_reset_tokens 
+                SET used = %s 
+                WHERE id = %s
+            """, (True, reset_token['id']))
+            
+            conn.commit()
+            cursor.close()
+        # Nothing neighbors see changed, so their nearby lists are left alone
+        user_cache.invalidate(reset_token['user_id'])
+        invalidate_user_everywhere(reset_token['user_id'])
         
         print(f"[PASSWORD RESET] Password successfully reset for user_id: {reset_token['user_id']}")
         
         return jsonify({'message': 'Password has been reset successfully'}), 200
         
+    except PasswordHasherBusy:
+        return hasher_busy_response()
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
         print(f"Reset password error: {str(e)}")
         return jsonify({'error': 'An error occurred. Please try again.'}), 500
\ No newline at end of file
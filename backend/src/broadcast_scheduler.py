@@ -0,0 +1,101 @@
+"""
+Tick-based broadcast scheduler for nearby-user updates
+Location events only mark recipients dirty (or queue a neighbor's new
+position for positions-mode recipients); each tick sends every recipient
+at most one message
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+
+class BroadcastScheduler:
+    """
+    Coalesces nearby-user broadcasts per recipient per tick
+    A tick_interval of 0 sends as soon as recipients are marked dirty
+    """
+
+    def __init__(
+        self,
+        tick_interval: float,
+        build_payloads: Callable[[Iterable[int]], Dict[int, List[Dict]]],
+        send: Callable[[int, List[Dict]], None],
+        send_moves: Optional[Callable[[int, List[Dict]], None]] = None
+    ):
+        self.tick_interval = tick_interval
+        self.build_payloads = build_payloads
+        self.send = send
+        self.send_moves = send_moves
+        self.dirty: Set[int] = set()
+        # recipient -> mover -> latest position entry, sent as one batch per tick
+        self.pending_moves: Dict[int, Dict[int, Dict]] = {}
+        self.lock = threading.Lock()
+        self.running = False
+
+    def mark_dirty(self, user_ids: Iterable[int]) -> None:
+        """
+        Schedule a refreshed nearby list for each user on the next tick
+        """
+        with self.lock:
+            self.dirty.update(user_ids)
+        if self.tick_interval <= 0:
+            self.tick()
+
+    def queue_moves(self, user_ids: Iterable[int], entry: Dict) -> None:
+        """
+        Queue a mover's new position entry for each recipient on the next tick
+        A later move by the same user replaces the queued one
+        """
+        with self.lock:
+            for user_id in user_ids:
+                self.pending_moves.setdefault(user_id, {})[entry['userId']] = entry
+        if self.tick_interval <= 0:
+            self.tick()
+
+    def tick(self) -> int:
+        """
+        Build and send one payload per dirty recipient, then one batch of
+        moves per recipient that isn't getting a full list anyway
+        Returns the number of messages sent
+        """
+        with self.lock:
+            recipients, self.dirty = self.dirty, set()
+            moves, self.pending_moves = self.pending_moves, {}
+
+        sent = 0
+        if recipients:
+            payloads = self.build_payloads(recipients)
+            for user_id, payload in payloads.items():
+                try:
+                    self.send(user_id, payload)
+                except Exception as e:
+                    print(f"Error broadcasting to user {user_id}: {str(e)}")
+            sent += len(payloads)
+
+        for user_id, entries in moves.items():
+            # A refreshed list already carries every neighbor's latest position
+            if user_id in recipients or self.send_moves is None:
+                continue
+            try:
+                self.send_moves(user_id, list(entries.values()))
+                sent += 1
+            except Exception as e:
+                print(f"Error sending moves to user {user_id}: {str(e)}")
+        return sent
+
+    def run(self, sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        Tick loop, meant to run as a background task (pass socketio.sleep under eventlet)
+        """
+        if self.running or self.tick_interval <= 0:
+            return
+        self.running = True
+        while self.running:
+            sleep(self.tick_interval)
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error in broadcast tick: {str(e)}")
+
+    def stop(self) -> None:
+        self.running = False
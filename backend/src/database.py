@@ -1,19 +1,236 @@
 import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 import psycopg2
-from psycopg2 import pool
+from psycopg2 import extensions, pool
 from dotenv import load_dotenv
 
 load_dotenv()
 
+class PoolTimeoutError(pool.PoolError):
+    """Raised when no connection frees up within the checkout timeout"""
+
+class PoolQueueFullError(PoolTimeoutError):
+    """Raised straight away when the wait queue is already full"""
+
+class ConnectionPool:
+    """
+    Thread-safe (and green-thread-safe under eventlet monkey patching) pool
+    Callers wait in a bounded queue instead of failing when all connections are out;
+    once max_waiting callers are queued, further checkouts are rejected immediately
+    """
+    def __init__(self, minconn, maxconn, timeout, max_lifetime, health_check_idle, max_waiting, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_waiting = max_waiting
+        self.max_lifetime = max_lifetime
+        self.health_check_idle = health_check_idle
+        self.connect_kwargs = connect_kwargs
+
+        self.condition = threading.Condition()
+        self.idle = deque()  # (connection, created_at, returned_at)
+        self.created_at = {}  # id(connection) -> created_at
+        self.size = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+        try:
+            for _ in range(minconn):
+                conn = self._connect()
+                self.idle.append((conn, self.created_at[id(conn)], time.monotonic()))
+        except Exception as e:
+            # Connections are opened lazily on checkout once the database is reachable
+            print(f"Error opening initial database connections: {e}")
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self.condition:
+            self.size += 1
+            self.created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        with self.condition:
+            # Only connections this pool opened count towards its size
+            if self.created_at.pop(id(conn), None) is not None:
+                self.size -= 1
+                self.condition.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, created_at, returned_at):
+        now = time.monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if now - returned_at < self.health_check_idle:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to timeout seconds for one to free up"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            create = False
+            with self.condition:
+                if not self.idle and self.size >= self.maxconn:
+                    if self.waiting >= self.max_waiting:
+                        self.rejected += 1
+                        raise PoolQueueFullError(f'{self.waiting} callers already waiting for a database connection')
+                    self.waiting += 1
+                    try:
+                        while not self.idle and self.size >= self.maxconn:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                self.timeouts += 1
+                                raise PoolTimeoutError(f'No database connection available within {timeout}s')
+                            self.condition.wait(remaining)
+                    finally:
+                        self.waiting -= 1
+
+                if self.idle:
+                    conn, created_at, returned_at = self.idle.pop()
+                else:
+                    # Reserve the slot now, connect outside the lock
+                    self.size += 1
+                    create = True
+
+            if create:
+                try:
+                    conn = psycopg2.connect(**self.connect_kwargs)
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+                with self.condition:
+                    self.created_at[id(conn)] = time.monotonic()
+            elif not self._is_healthy(conn, created_at, returned_at):
+                self._discard(conn)
+                continue
+
+            waited = time.monotonic() - started
+            with self.condition:
+                self.in_use += 1
+                self.checkouts += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+            return conn
+
+    def putconn(self, conn):
+        """Return a connection, rolling back anything left open and recycling old ones"""
+        with self.condition:
+            created_at = self.created_at.get(id(conn))
+            if created_at is None:
+                raise pool.PoolError('Trying to return a connection this pool does not own')
+            self.in_use -= 1
+
+        if conn.closed:
+            self._discard(conn)
+            return
+        try:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        if time.monotonic() - created_at > self.max_lifetime:
+            self._discard(conn)
+            return
+
+        with self.condition:
+            self.idle.append((conn, created_at, time.monotonic()))
+            self.condition.notify()
+
+    def closeall(self):
+        with self.condition:
+            idle, self.idle = list(self.idle), deque()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'max': self.maxconn,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'avg_wait_ms': round(1000 * self.total_wait / self.checkouts, 2) if self.checkouts else 0.0,
+                'max_wait_ms': round(1000 * self.max_wait, 2),
+            }
+
+def eventlet_wait_callback(conn, timeout=None):
+    """
+    Wait for psycopg2 I/O by yielding to the eventlet hub instead of blocking
+    the whole worker while Postgres answers
+    """
+    from eventlet.hubs import trampoline
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            trampoline(conn.fileno(), read=True)
+        elif state == extensions.POLL_WRITE:
+            trampoline(conn.fileno(), write=True)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+def install_green_wait_callback():
+    """
+    Make psycopg2 cooperative when running under eventlet (Gunicorn's eventlet
+    worker monkey patches before the app is imported)
+    Returns True if the callback was installed
+    """
+    eventlet = sys.modules.get('eventlet')
+    if eventlet is None or not eventlet.patcher.is_monkey_patched('socket'):
+        return False
+    extensions.set_wait_callback(eventlet_wait_callback)
+    return True
+
 class Database:
     def __init__(self):
         self.connection_pool = None
+        if install_green_wait_callback():
+            print("Using eventlet wait callback for database I/O")
         self.create_connection_pool()
-    
+
     def create_connection_pool(self):
         try:
-            self.connection_pool = psycopg2.pool.SimpleConnectionPool(
-                1, 20,
+            self.connection_pool = ConnectionPool(
+                int(os.getenv('DB_POOL_MIN', 1)),
+                int(os.getenv('DB_POOL_MAX', 20)),
+                timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+                max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+                health_check_idle=float(os.getenv('DB_POOL_HEALTH_CHECK_IDLE', 30)),
+                # Callers allowed to queue for a connection before new checkouts fail fast
+                max_waiting=int(os.getenv('DB_POOL_MAX_WAITING', 50)),
                 user=os.getenv('DB_USER', 'masterhulkfung'),
                 host=os.getenv('DB_HOST', 'localhost'),
                 database=os.getenv('DB_NAME', 'chickalo'),
@@ -23,13 +240,32 @@ class Database:
             print("Database connection pool created successfully")
         except Exception as e:
             print(f"Error creating connection pool: {e}")
-    
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a pooled connection for the duration of a with block
+        Rolls back on error and always returns the connection
+        """
+        conn = self.get_connection()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.return_connection(conn)
+
     def get_connection(self):
         return self.connection_pool.getconn()
-    
+
     def return_connection(self, connection):
         self.connection_pool.putconn(connection)
-    
+
+    def pool_stats(self):
+        return self.connection_pool.stats() if self.connection_pool else {}
+
     def close_all_connections(self):
         if self.connection_pool:
             self.connection_pool.closeall()
@@ -0,0 +1,82 @@
+"""
+Distance and proximity math shared by the location, presence and store modules
+Kept free of app state so any module can import it at top level
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+# Earth's radius in meters (spatial_index sizes its cells with the same value)
+EARTH_RADIUS_METERS = 6371000
+
+# Proximity radius in meters (250 feet = ~76 meters)
+PROXIMITY_RADIUS_METERS = 76.2
+
+
+def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Calculate distance between two coordinates using Haversine formula
+    Returns distance in meters
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    a = (math.sin(delta_phi / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2)
+
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    distance = EARTH_RADIUS_METERS * c  # Distance in meters
+    return distance
+
+
+def is_within_proximity(lat1: float, lon1: float, lat2: float, lon2: float) -> bool:
+    """
+    Check if two coordinates are within proximity radius
+    """
+    distance = calculate_distance(lat1, lon1, lat2, lon2)
+    return distance <= PROXIMITY_RADIUS_METERS
+
+
+def calculate_distance_many(
+    lat: float,
+    lon: float,
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    cos_latitudes: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Vectorized Haversine distance from one coordinate to many
+    cos_latitudes can be passed in when already precomputed (see PresenceTable)
+    Returns distances in meters
+    """
+    phi1 = math.radians(lat)
+    phi2 = np.radians(latitudes)
+    delta_phi = phi2 - phi1
+    delta_lambda = np.radians(np.asarray(longitudes) - lon)
+    if cos_latitudes is None:
+        cos_latitudes = np.cos(phi2)
+
+    a = (np.sin(delta_phi / 2) ** 2 +
+         math.cos(phi1) * cos_latitudes * np.sin(delta_lambda / 2) ** 2)
+
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_METERS * c
+
+
+def within_proximity_mask(
+    lat: float,
+    lon: float,
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    cos_latitudes: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Boolean mask of which coordinates are within proximity radius
+    """
+    distances = calculate_distance_many(lat, lon, latitudes, longitudes, cos_latitudes)
+    return distances <= PROXIMITY_RADIUS_METERS
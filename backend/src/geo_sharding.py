@@ -0,0 +1,133 @@
+"""
+Geo-sharded presence
+The map is cut into square regions, each region is owned by one shard, and
+every user is written to their region's owner plus any shard that owns a
+region within the proximity radius (border replication). A nearby query then
+only ever needs the querying user's owner shard.
+"""
+import math
+import threading
+from typing import Dict, List, Set, Tuple
+
+from presence import PresenceBackend
+from spatial_index import bounding_box
+
+Region = Tuple[int, int]
+
+
+class ShardMap:
+    """
+    Assigns square lat/lon regions to shards
+    """
+
+    def __init__(self, shard_count: int, region_degrees: float, radius_meters: float):
+        self.shard_count = shard_count
+        self.region_degrees = region_degrees
+        self.radius_meters = radius_meters
+
+    def region_for(self, latitude: float, longitude: float) -> Region:
+        return (math.floor(latitude / self.region_degrees), math.floor(longitude / self.region_degrees))
+
+    def owner_of_region(self, region: Region) -> int:
+        row, col = region
+        return ((row * 73856093) ^ (col * 19349663)) % self.shard_count
+
+    def owner_of(self, latitude: float, longitude: float) -> int:
+        return self.owner_of_region(self.region_for(latitude, longitude))
+
+    def shards_for(self, latitude: float, longitude: float) -> Set[int]:
+        """
+        Get the owner shard plus every shard owning a region the user's
+        proximity circle reaches into
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, self.radius_meters)
+        min_row, min_col = self.region_for(min_lat, min_lon)
+        max_row, max_col = self.region_for(max_lat, max_lon)
+        return {
+            self.owner_of_region((row, col))
+            for row in range(min_row, max_row + 1)
+            for col in range(min_col, max_col + 1)
+        }
+
+
+class ShardedPresenceBackend(PresenceBackend):
+    """
+    Routes presence to per-shard backends (e.g. one Redis per shard)
+    The proximity graph and pub/sub live in a separate graph backend, so a
+    user handed off between shards keeps their neighbor set
+    """
+
+    def __init__(self, shard_map: ShardMap, shards: List[PresenceBackend], graph_backend: PresenceBackend):
+        super().__init__()
+        self.shard_map = shard_map
+        self.shards = shards
+        self.graph_backend = graph_backend
+        # user_id -> shards holding that user's position (for users this process writes)
+        self.placement: Dict[int, Set[int]] = {}
+        self.lock = threading.Lock()
+
+    def update(self, user_id, latitude, longitude):
+        targets = self.shard_map.shards_for(latitude, longitude)
+        with self.lock:
+            # Unknown placement (first update in this process): clear every other shard once
+            previous = self.placement.get(user_id, set(range(len(self.shards))))
+            self.placement[user_id] = targets
+
+        # Write the new shards before leaving the old ones so the user never disappears
+        for shard in targets:
+            self.shards[shard].update(user_id, latitude, longitude)
+        for shard in previous - targets:
+            self.shards[shard].remove(user_id)
+
+    def remove(self, user_id):
+        with self.lock:
+            placed = self.placement.pop(user_id, set(range(len(self.shards))))
+        for shard in placed:
+            self.shards[shard].remove(user_id)
+        return self.graph_backend.remove(user_id)
+
+    def nearby_positions(self, user_id, latitude, longitude):
+        # Border replication puts everyone within the radius in the owner shard
+        owner = self.shard_map.owner_of(latitude, longitude)
+        return self.shards[owner].nearby_positions(user_id, latitude, longitude)
+
+    def positions(self, user_ids):
+        missing = set(user_ids)
+        positions = {}
+        for shard in self.shards:
+            if not missing:
+                break
+            found = shard.positions(missing)
+            positions.update(found)
+            missing -= found.keys()
+        return positions
+
+    def set_neighbors(self, user_id, neighbor_ids):
+        return self.graph_backend.set_neighbors(user_id, neighbor_ids)
+
+    def neighbors(self, user_id):
+        return self.graph_backend.neighbors(user_id)
+
+    def neighbors_many(self, user_ids):
+        return self.graph_backend.neighbors_many(user_ids)
+
+    def publish(self, channel, message):
+        self.graph_backend.publish(channel, message)
+
+    def purge_stale(self, batch_size):
+        stale = set()
+        for shard in self.shards:
+            stale.update(shard.purge_stale(batch_size))
+        # Edges live in the graph backend, not with the positions
+        removed = {}
+        for user_id in stale:
+            with self.lock:
+                self.placement.pop(user_id, None)
+            removed[user_id] = self.graph_backend.remove(user_id)
+        return removed
+
+    def subscribe(self, channel, callback):
+        self.graph_backend.subscribe(channel, callback)
+
+    def start(self, start_background_task):
+        self.graph_backend.start(start_background_task)
@@ -0,0 +1,84 @@
+"""
+Server-side ingest rules for location:update
+Clients choose their own send rate, so each session is held to a minimum
+interval and minimum displacement, updates older than the last one seen are
+dropped, and a burst inside the interval collapses to its latest position
+"""
+import os
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+from geo import calculate_distance
+
+INGEST_MIN_INTERVAL_SECONDS = float(os.getenv('INGEST_MIN_INTERVAL_SECONDS', 1.0))
+INGEST_MIN_DISPLACEMENT_METERS = float(os.getenv('INGEST_MIN_DISPLACEMENT_METERS', 2.0))
+# A stationary user is still accepted this often so their presence never goes stale
+INGEST_KEEPALIVE_SECONDS = float(os.getenv('INGEST_KEEPALIVE_SECONDS', 30))
+
+ACCEPT = 'accept'
+DEFER = 'defer'
+DROP = 'drop'
+
+
+def parse_client_timestamp(value) -> Optional[float]:
+    """
+    Get a client timestamp in seconds since the epoch
+    JSON clients send ISO 8601 strings, binary clients send milliseconds
+    """
+    if value is None:
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            return value / 1000
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def check_update(session, latitude: float, longitude: float, timestamp: Optional[float],
+                 now: Optional[float] = None) -> str:
+    """
+    Decide what to do with an incoming update
+    DEFER means it was kept as the session's pending update for the end of the interval
+    """
+    now = time.time() if now is None else now
+
+    newest = session.last_client_timestamp
+    if session.pending_update is not None and session.pending_update[2] is not None:
+        newest = max(newest or 0, session.pending_update[2])
+    if timestamp is not None and newest is not None and timestamp < newest:
+        return DROP
+
+    # First position for this session (or since rejoining)
+    if session.latitude is None:
+        return ACCEPT
+
+    if now - session.last_ingest < INGEST_MIN_INTERVAL_SECONDS:
+        session.pending_update = (latitude, longitude, timestamp)
+        return DEFER
+
+    moved = calculate_distance(session.latitude, session.longitude, latitude, longitude)
+    if moved < INGEST_MIN_DISPLACEMENT_METERS and now - session.last_ingest < INGEST_KEEPALIVE_SECONDS:
+        return DROP
+
+    return ACCEPT
+
+
+def record_accepted(session, timestamp: Optional[float], now: Optional[float] = None) -> None:
+    session.last_ingest = time.time() if now is None else now
+    if timestamp is not None:
+        session.last_client_timestamp = timestamp
+
+
+def pending_delay(session, now: Optional[float] = None) -> float:
+    """
+    Seconds until the session's pending update may be applied
+    """
+    now = time.time() if now is None else now
+    return max(0.0, session.last_ingest + INGEST_MIN_INTERVAL_SECONDS - now)
+
+
+def take_pending(session) -> Optional[Tuple[float, float, Optional[float]]]:
+    pending, session.pending_update = session.pending_update, None
+    return pending
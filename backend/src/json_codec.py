@@ -0,0 +1,162 @@
+"""
+JSON encoding for Socket.IO packets and Flask responses
+Uses orjson (the standard library only stands in if it fails to import) and
+lets payloads embed pre-serialized fragments, so a neighbor's entry is
+encoded once per version/position instead of once per recipient
+"""
+import dataclasses
+import decimal
+import json
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, Hashable
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    print("orjson is not installed; encoding JSON with the standard library")
+
+# Fragments are written as placeholder strings and spliced in after encoding;
+# the per-process token keeps user-supplied text from ever matching one
+PLACEHOLDER_TOKEN = uuid.uuid4().hex
+PLACEHOLDER_PATTERN = re.compile(r'"\\u0000' + PLACEHOLDER_TOKEN + r':(\d+)\\u0000"')
+
+
+class RawJSON:
+    """
+    Already-serialized JSON value, embedded as-is wherever it appears in a payload
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __reduce__(self):
+        # Message queues pickle emits
+        return (RawJSON, (self.text,))
+
+
+def _default(obj, fragments):
+    if isinstance(obj, RawJSON):
+        fragments.append(obj.text)
+        return f'\x00{PLACEHOLDER_TOKEN}:{len(fragments) - 1}\x00'
+    # Same conversions as Flask's default provider
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(obj, **kwargs) -> str:
+    """
+    Compact JSON text (keyword arguments such as separators are accepted and ignored)
+    """
+    fragments = []
+    default = lambda value: _default(value, fragments)
+    if orjson is not None:
+        text = orjson.dumps(obj, default=default, option=(
+            orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+        )).decode('utf-8')
+    else:
+        text = json.dumps(obj, default=default, separators=(',', ':'), ensure_ascii=False)
+    if fragments:
+        text = PLACEHOLDER_PATTERN.sub(lambda match: fragments[int(match.group(1))], text)
+    return text
+
+
+def loads(text, **kwargs):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by dumps/loads above
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+
+class FragmentCache:
+    """
+    Bounded LRU of (kind, user_id) -> (version key, fragment)
+    Only the latest version of each user's fragment is kept
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, user_id: int, key: Hashable, build: Callable[[], object]):
+        cache_key = (kind, user_id)
+        with self.lock:
+            cached = self.entries.get(cache_key)
+            if cached is not None and cached[0] == key:
+                self.entries.move_to_end(cache_key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        value = build()
+        with self.lock:
+            self.entries[cache_key] = (key, value)
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def _profile_members(user: Dict) -> str:
+    """
+    A user's profile fields as JSON object members (no braces), cached per profile version
+    """
+    return fragment_cache.get('profile', user['userId'], user['profile_version'], lambda: dumps({
+        field: value for field, value in user.items() if field not in ('latitude', 'longitude')
+    })[1:-1])
+
+
+def profile_fragment(user: Dict) -> RawJSON:
+    """
+    Pre-serialized profile (any position fields are left out)
+    """
+    return RawJSON('{' + _profile_members(user) + '}')
+
+
+def nearby_entry(user: Dict) -> RawJSON:
+    """
+    Pre-serialized nearby-users entry, shared by every recipient that sees this
+    user at this version and position
+    """
+    latitude, longitude = user['latitude'], user['longitude']
+    return fragment_cache.get('nearby', user['userId'], (user['profile_version'], latitude, longitude), lambda: RawJSON(
+        '{' + _profile_members(user) + f',"latitude":{dumps(latitude)},"longitude":{dumps(longitude)}' + '}'
+    ))
+
+
+# Global fragment cache (two entries per active user)
+fragment_cache = FragmentCache(int(os.getenv('FRAGMENT_CACHE_SIZE', 20000)))
@@ -2,108 +2,183 @@
 Location management utilities for real-time user tracking
 Handles proximity calculations and location updates
 """
-import math
-from typing import List, Dict, Tuple, Optional
-from database import db
+import os
+import time
+from typing import List, Dict, Iterable, Set, Tuple, Optional
+# Distance helpers live in geo (re-exported here for existing callers)
+from geo import PROXIMITY_RADIUS_METERS, calculate_distance, is_within_proximity, calculate_distance_many, within_proximity_mask
+from location_store import create_location_store
+from maintenance import ExpiryHeap
+from presence import PROCESS_ID, create_presence_backend
+from proximity_graph import ProximityGraph
+from spatial_index import SpatialGrid, cell_to_id
+from user_cache import user_cache, profile_version
 
-# Proximity radius in meters (250 feet = ~76 meters)
-PROXIMITY_RADIUS_METERS = 76.2
+# Locations older than this are treated as stale (matches the 5 minute SQL interval)
+LOCATION_STALE_SECONDS = 5 * 60
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+# Where nearby queries read positions from: 'memory' (presence backend) or 'database' (location store)
+PROXIMITY_SOURCE = os.getenv('PROXIMITY_SOURCE', 'memory')
+
+# In-process index of current positions (backs the local presence backend and the memory location store)
+spatial_index = SpatialGrid(PROXIMITY_RADIUS_METERS)
+
+# Where locations are stored: Postgres (write-behind) or process memory, per LOCATION_STORE
+location_store = create_location_store(spatial_index, PROXIMITY_RADIUS_METERS, LOCATION_STALE_SECONDS)
+
+# Who is currently near whom, updated only for the edges a mover touches
+proximity_graph = ProximityGraph()
+
+# When each position this process wrote goes stale (drained by the maintenance scheduler)
+presence_expiry = ExpiryHeap()
+
+# Where positions and edges live; shared across workers with PRESENCE_BACKEND=redis
+presence = create_presence_backend(spatial_index, proximity_graph, PROXIMITY_RADIUS_METERS, LOCATION_STALE_SECONDS,
+                                   expiry=presence_expiry, store=location_store)
+
+# Rows deleted per statement by the periodic purges
+PURGE_BATCH_SIZE = int(os.getenv('PURGE_BATCH_SIZE', 1000))
+
+
+def invalidate_user_everywhere(user_id: int) -> None:
     """
-    Calculate distance between two coordinates using Haversine formula
-    Returns distance in meters
+    Tell other workers to drop their cached copy of a user
     """
-    R = 6371000  # Earth's radius in meters
-    
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    
-    a = (math.sin(delta_phi / 2) ** 2 +
-         math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2)
-    
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    
-    distance = R * c  # Distance in meters
-    return distance
+    presence.publish('user-changed', {'origin': PROCESS_ID, 'user_id': user_id})
 
 
-def is_within_proximity(lat1: float, lon1: float, lat2: float, lon2: float) -> bool:
+def notify_user_changed(user_id: int) -> None:
     """
-    Check if two coordinates are within proximity radius
+    Invalidate a user everywhere after a profile edit, then refresh the nearby
+    lists of everyone who can currently see them (so the new profile and
+    profile_version reach them without waiting for someone to move)
     """
-    distance = calculate_distance(lat1, lon1, lat2, lon2)
-    return distance <= PROXIMITY_RADIUS_METERS
+    invalidate_user_everywhere(user_id)
+    neighbors = presence.neighbors(user_id)
+    if neighbors:
+        presence.publish('nearby-dirty', list(neighbors))
+
+
+def _on_user_changed(message: Dict) -> None:
+    if message['origin'] != PROCESS_ID:
+        user_cache.invalidate(message['user_id'])
+
 
+presence.subscribe('user-changed', _on_user_changed)
 
 def update_user_location(user_id: int, latitude: float, longitude: float) -> bool:
     """
     Update or insert user's current location
     Only stores location for active users
+    The index is updated immediately; the stored copy goes through location_store
     """
-    conn = db.get_connection()
-    if not conn:
-        return False
+    # First check if user is active
+    state = user_cache.get(user_id)
     
-    try:
-        cursor = conn.cursor()
-        
-        # First check if user is active
-        cursor.execute("SELECT is_active FROM users WHERE id = %s", (user_id,))
-        result = cursor.fetchone()
-        
-        if not result or not result[0]:
-            # User is not active, don't store location
-            # Delete any existing location
-            cursor.execute("DELETE FROM user_locations WHERE user_id = %s", (user_id,))
-            conn.commit()
-            db.return_connection(conn)
-            return False
-        
-        # Upsert location (insert or update if exists)
-        cursor.execute("""
-            INSERT INTO user_locations (user_id, latitude, longitude, last_updated)
-            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-            ON CONFLICT (user_id) 
-            DO UPDATE SET 
-                latitude = EXCLUDED.latitude,
-                longitude = EXCLUDED.longitude,
-                last_updated = CURRENT_TIMESTAMP
-        """, (user_id, latitude, longitude))
-        
-        conn.commit()
-        return True
-        
-    except Exception as e:
-        print(f"Error updating user location: {str(e)}")
-        conn.rollback()
+    if not state or not state['is_active']:
+        # User is not active, don't store location
+        # Delete any existing location
+        delete_user_location(user_id)
         return False
-    finally:
-        db.return_connection(conn)
+    
+    latitude, longitude = float(latitude), float(longitude)
+    presence.update(user_id, latitude, longitude)
+    presence_expiry.touch(user_id, time.time() + LOCATION_STALE_SECONDS)
+    cell = spatial_index.cell_for(latitude, longitude)
+    location_store.save(user_id, latitude, longitude, cell_to_id(cell))
+    return True
 
 
 def delete_user_location(user_id: int) -> bool:
     """
     Delete user's location (when they go inactive)
     Privacy feature: no location stored when inactive
+    Removal from the index is immediate; a Postgres store deletes the row on its next flush
     """
-    conn = db.get_connection()
-    if not conn:
-        return False
+    presence.remove(user_id)
+    presence_expiry.discard(user_id)
+    location_store.delete(user_id)
+    return True
+
+
+def purge_stale_locations(batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """
+    Delete stored locations that went stale without an explicit delete
+    (crashed workers, dropped connections)
+    Returns the number of locations deleted
+    """
+    return location_store.purge_stale(batch_size)
+
+
+def find_nearby_positions(
+    user_id: int, 
+    latitude: float, 
+    longitude: float
+) -> Dict[int, Tuple[float, float]]:
+    """
+    Get {user_id: (latitude, longitude)} for fresh users within proximity
+    Excludes the requesting user
+    """
+    if PROXIMITY_SOURCE == 'database':
+        return location_store.nearby_positions(user_id, latitude, longitude)
     
-    try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM user_locations WHERE user_id = %s", (user_id,))
-        conn.commit()
-        return True
-    except Exception as e:
-        print(f"Error deleting user location: {str(e)}")
-        conn.rollback()
-        return False
-    finally:
-        db.return_connection(conn)
+    return presence.nearby_positions(user_id, latitude, longitude)
+
+
+def fetch_positions(user_ids: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+    """
+    Get {user_id: (latitude, longitude)} for users with a fresh location
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    
+    if PROXIMITY_SOURCE == 'database':
+        return location_store.positions(user_ids)
+    
+    return presence.positions(user_ids)
+
+
+def fetch_active_profiles(user_ids: Iterable[int]) -> Dict[int, Dict]:
+    """
+    Get profile fields for the active users among user_ids
+    Served from the user state cache; misses are loaded in a single query
+    Returns {user_id: profile}
+    """
+    profiles = {}
+    for other_id, state in user_cache.get_many(user_ids).items():
+        if not state['is_active']:
+            continue
+        profiles[other_id] = {
+            'userId': state['id'],
+            'username': state['username'],
+            'avatar_data': state['avatar_data'],
+            'is_active': state['is_active'],
+            'headline': state['headline'],
+            'pronouns': state['pronouns'],
+            'profile_version': profile_version(state['updated_at']),
+        }
+    return profiles
+
+
+def _build_nearby_list(
+    neighbor_ids: Iterable[int], 
+    profiles: Dict[int, Dict],
+    positions: Dict[int, Tuple[float, float]]
+) -> List[Dict]:
+    """
+    Combine profiles and positions into the location:nearby-users payload
+    """
+    nearby_users = []
+    for other_id in neighbor_ids:
+        profile = profiles.get(other_id)
+        position = positions.get(other_id)
+        if not profile or not position:
+            continue
+        user_data = dict(profile)
+        user_data['latitude'], user_data['longitude'] = position
+        nearby_users.append(user_data)
+    return nearby_users
 
 
 def get_nearby_active_users(
@@ -116,60 +191,39 @@ def get_nearby_active_users(
     Returns list of user data including location and avatar
     Excludes the requesting user
     """
-    conn = db.get_connection()
-    if not conn:
-        return []
-    
-    try:
-        cursor = conn.cursor()
-        
-        # Get all active users with locations (excluding current user)
-        cursor.execute("""
-            SELECT 
-                u.id, 
-                u.username, 
-                u.avatar_data, 
-                u.is_active,
-                u.headline,
-                u.pronouns,
-                ul.latitude, 
-                ul.longitude,
-                ul.last_updated
-            FROM users u
-            INNER JOIN user_locations ul ON u.id = ul.user_id
-            WHERE u.is_active = true 
-            AND u.id != %s
-            AND ul.last_updated > NOW() - INTERVAL '5 minutes'
-        """, (user_id,))
-        
-        results = cursor.fetchall()
-        nearby_users = []
-        
-        # Filter by proximity
-        for row in results:
-            user_lat, user_lon = float(row[6]), float(row[7])
-            
-            if is_within_proximity(latitude, longitude, user_lat, user_lon):
-                user_data = {
-                    'userId': row[0],
-                    'username': row[1],
-                    'avatar_data': row[2],
-                    'is_active': row[3],
-                    'headline': row[4],
-                    'pronouns': row[5],
-                    'latitude': float(user_lat),
-                    'longitude': float(user_lon),
-                }
-                print(f"[DEBUG] Nearby user data: {user_data['username']} - pronouns: {user_data['pronouns']}")
-                nearby_users.append(user_data)
-        
-        return nearby_users
-        
-    except Exception as e:
-        print(f"Error getting nearby users: {str(e)}")
-        return []
-    finally:
-        db.return_connection(conn)
+    positions = find_nearby_positions(user_id, latitude, longitude)
+    profiles = fetch_active_profiles(positions)
+    return _build_nearby_list(positions, profiles, positions)
+
+
+def update_proximity_graph(
+    user_id: int, 
+    latitude: float, 
+    longitude: float
+) -> Tuple[Set[int], Set[int], Set[int]]:
+    """
+    Recompute the mover's edges in the proximity graph
+    Returns (neighbor_ids, entered_ids, departed_ids) where entered users just came
+    into the radius and departed users just left it
+    """
+    positions = find_nearby_positions(user_id, latitude, longitude)
+    added, removed = presence.set_neighbors(user_id, positions)
+    return set(positions), added, removed
+
+
+def build_nearby_payloads(user_ids: Iterable[int]) -> Dict[int, List[Dict]]:
+    """
+    Build the nearby list for each recipient from the proximity graph
+    All profiles involved are loaded with one query
+    Returns {user_id: nearby_users}
+    """
+    neighborhoods = presence.neighbors_many(user_ids)
+    positions = fetch_positions(set().union(*neighborhoods.values()))
+    profiles = fetch_active_profiles(positions)
+    return {
+        user_id: _build_nearby_list(neighbor_ids, profiles, positions)
+        for user_id, neighbor_ids in neighborhoods.items()
+    }
 
 
 def get_user_location(user_id: int) -> Optional[Tuple[float, float]]:
@@ -177,25 +231,4 @@ def get_user_location(user_id: int) -> Optional[Tuple[float, float]]:
     Get user's current stored location
     Returns (latitude, longitude) or None
     """
-    conn = db.get_connection()
-    if not conn:
-        return None
-    
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT latitude, longitude 
-            FROM user_locations 
-            WHERE user_id = %s
-        """, (user_id,))
-        
-        result = cursor.fetchone()
-        if result:
-            return (float(result[0]), float(result[1]))
-        return None
-        
-    except Exception as e:
-        print(f"Error getting user location: {str(e)}")
-        return None
-    finally:
-        db.return_connection(conn)
+    return location_store.get(user_id)
@@ -0,0 +1,331 @@
+"""
+Where stored locations live
+Locations are ephemeral by design (deleted as soon as a user goes inactive),
+so the store is pluggable: Postgres with write-behind batching, or process
+memory with optional periodic snapshots that takes GPS ticks off the database
+
+postgres: user_locations table (survives restarts, visible to every worker)
+memory: in-process grid; LOCATION_SNAPSHOT_PATH keeps it across restarts
+"""
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from database import db
+from geo import within_proximity_mask
+from location_writer import LocationWriteBuffer
+from spatial_index import SpatialGrid, bounding_box, cell_to_id
+
+# (user_id, latitude, longitude, updated_at epoch seconds)
+StoredLocation = Tuple[int, float, float, float]
+
+
+class LocationStore(ABC):
+    """
+    Interface every location store implements
+    """
+
+    @abstractmethod
+    def save(self, user_id: int, latitude: float, longitude: float, cell_id: int) -> None:
+        """
+        Store a user's latest position
+        """
+
+    @abstractmethod
+    def delete(self, user_id: int) -> None:
+        """
+        Drop a user's position
+        """
+
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[Tuple[float, float]]:
+        """
+        Get a user's stored (latitude, longitude), fresh or not
+        """
+
+    @abstractmethod
+    def nearby_positions(self, user_id: int, latitude: float, longitude: float) -> Dict[int, Tuple[float, float]]:
+        """
+        Get {user_id: (latitude, longitude)} for fresh users within proximity, excluding user_id
+        """
+
+    @abstractmethod
+    def positions(self, user_ids: List[int]) -> Dict[int, Tuple[float, float]]:
+        """
+        Get {user_id: (latitude, longitude)} for the fresh users among user_ids
+        """
+
+    @abstractmethod
+    def fresh_locations(self) -> List[StoredLocation]:
+        """
+        Get every fresh location of an active user (seeds the presence index on startup)
+        Raises if the store can't be read, so the caller can retry later
+        """
+
+    @abstractmethod
+    def purge_stale(self, batch_size: int) -> int:
+        """
+        Drop locations that went stale without an explicit delete, returning the count
+        """
+
+    def run(self, sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        Background loop for the store, if it needs one (pass socketio.sleep under eventlet)
+        """
+
+
+class PostgresLocationStore(LocationStore):
+    """
+    user_locations table, written through a LocationWriteBuffer
+    """
+
+    def __init__(self, cell_grid: SpatialGrid, radius_meters: float, stale_seconds: float, flush_interval: float):
+        self.cell_grid = cell_grid
+        self.radius_meters = radius_meters
+        self.stale_seconds = stale_seconds
+        self.writer = LocationWriteBuffer(flush_interval)
+
+    def save(self, user_id, latitude, longitude, cell_id):
+        self.writer.queue_upsert(user_id, latitude, longitude, cell_id)
+
+    def delete(self, user_id):
+        self.writer.queue_delete(user_id)
+
+    def get(self, user_id):
+        try:
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT latitude, longitude
+                    FROM user_locations
+                    WHERE user_id = %s
+                """, (user_id,))
+                result = cursor.fetchone()
+                if result:
+                    return (float(result[0]), float(result[1]))
+                return None
+        except Exception as e:
+            print(f"Error getting user location: {str(e)}")
+            return None
+
+    def nearby_positions(self, user_id, latitude, longitude):
+        """
+        Narrows rows by neighboring cell ids and a lat/lon bounding box (both indexed)
+        before the exact distance check
+        """
+        cell_ids = [cell_to_id(cell) for cell in self.cell_grid.neighboring_cells(latitude, longitude)]
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, self.radius_meters)
+
+        try:
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT ul.user_id, ul.latitude, ul.longitude
+                    FROM user_locations ul
+                    WHERE ul.cell_id = ANY(%s)
+                    AND ul.latitude BETWEEN %s AND %s
+                    AND ul.longitude BETWEEN %s AND %s
+                    AND ul.user_id != %s
+                    AND ul.last_updated > NOW() - make_interval(secs => %s)
+                """, (cell_ids, min_lat, max_lat, min_lon, max_lon, user_id, self.stale_seconds))
+                rows = cursor.fetchall()
+        except Exception as e:
+            print(f"Error querying nearby locations: {str(e)}")
+            return {}
+
+        if not rows:
+            return {}
+
+        user_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        latitudes = np.array([row[1] for row in rows], dtype=np.float64)
+        longitudes = np.array([row[2] for row in rows], dtype=np.float64)
+        mask = within_proximity_mask(latitude, longitude, latitudes, longitudes)
+
+        return {
+            int(other_id): (float(other_lat), float(other_lon))
+            for other_id, other_lat, other_lon in zip(user_ids[mask], latitudes[mask], longitudes[mask])
+        }
+
+    def positions(self, user_ids):
+        try:
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT user_id, latitude, longitude
+                    FROM user_locations
+                    WHERE user_id = ANY(%s)
+                    AND last_updated > NOW() - make_interval(secs => %s)
+                """, (user_ids, self.stale_seconds))
+                return {row[0]: (float(row[1]), float(row[2])) for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"Error fetching user locations: {str(e)}")
+            return {}
+
+    def fresh_locations(self):
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT ul.user_id, ul.latitude, ul.longitude,
+                       EXTRACT(EPOCH FROM NOW() - ul.last_updated)
+                FROM user_locations ul
+                INNER JOIN users u ON u.id = ul.user_id
+                WHERE u.is_active = true
+                AND ul.last_updated > NOW() - make_interval(secs => %s)
+            """, (self.stale_seconds,))
+            now = time.time()
+            return [
+                (user_id, float(latitude), float(longitude), now - float(age_seconds))
+                for user_id, latitude, longitude, age_seconds in cursor.fetchall()
+            ]
+
+    def purge_stale(self, batch_size):
+        """
+        One small batch per statement so the purge never holds long locks
+        """
+        deleted = 0
+        try:
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                while True:
+                    cursor.execute("""
+                        DELETE FROM user_locations
+                        WHERE id IN (
+                            SELECT id FROM user_locations
+                            WHERE last_updated < NOW() - make_interval(secs => %s)
+                            LIMIT %s
+                        )
+                    """, (self.stale_seconds, batch_size))
+                    conn.commit()
+                    deleted += cursor.rowcount
+                    if cursor.rowcount < batch_size:
+                        break
+        except Exception as e:
+            print(f"Error purging stale locations: {str(e)}")
+        return deleted
+
+    def run(self, sleep=time.sleep):
+        self.writer.run(sleep)
+
+
+class MemoryLocationStore(LocationStore):
+    """
+    Locations in the process's SpatialGrid (the same grid the local presence
+    backend indexes, so each position is held once)
+    With a snapshot path the grid is written to disk every snapshot_interval
+    seconds and reloaded on startup (fresh entries only)
+    """
+
+    def __init__(self, grid: SpatialGrid, stale_seconds: float,
+                 snapshot_path: Optional[str] = None, snapshot_interval: float = 0):
+        self.grid = grid
+        self.stale_seconds = stale_seconds
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()
+        self.running = False
+        if snapshot_path:
+            self.load_snapshot()
+
+    def save(self, user_id, latitude, longitude, cell_id):
+        self.grid.update(user_id, latitude, longitude)
+
+    def delete(self, user_id):
+        self.grid.remove(user_id)
+
+    def get(self, user_id):
+        entry = self.grid.get(user_id)
+        return (entry[0], entry[1]) if entry else None
+
+    def nearby_positions(self, user_id, latitude, longitude):
+        return self.grid.nearby_positions(user_id, latitude, longitude, self.stale_seconds)
+
+    def positions(self, user_ids):
+        return self.grid.fresh_positions(user_ids, self.stale_seconds)
+
+    def _entries(self) -> List[StoredLocation]:
+        table = self.grid.table
+        with self.grid.lock:
+            slots = table.occupied_slots()
+            columns = (table.user_ids[slots], table.latitudes[slots], table.longitudes[slots], table.updated_at[slots])
+        return [
+            (int(user_id), float(latitude), float(longitude), int(updated_at) / 1000)
+            for user_id, latitude, longitude, updated_at in zip(*columns)
+        ]
+
+    def fresh_locations(self):
+        # Only active users are ever saved, and inactive ones are deleted
+        cutoff = time.time() - self.stale_seconds
+        return [entry for entry in self._entries() if entry[3] >= cutoff]
+
+    def purge_stale(self, batch_size):
+        cutoff = time.time() - self.stale_seconds
+        stale = [entry[0] for entry in self._entries() if entry[3] < cutoff]
+        for user_id in stale:
+            self.grid.remove(user_id)
+        return len(stale)
+
+    def save_snapshot(self) -> int:
+        """
+        Atomically write every fresh location to the snapshot file
+        Returns the number of locations written
+        """
+        entries = self.fresh_locations()
+        tmp_path = f'{self.snapshot_path}.tmp'
+        with self.lock:
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.snapshot_path)
+        return len(entries)
+
+    def load_snapshot(self) -> int:
+        try:
+            with open(self.snapshot_path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            print(f"Error loading location snapshot: {str(e)}")
+            return 0
+
+        cutoff = time.time() - self.stale_seconds
+        loaded = 0
+        for user_id, latitude, longitude, updated_at in entries:
+            if updated_at >= cutoff:
+                self.grid.update(user_id, latitude, longitude, updated_at)
+                loaded += 1
+        return loaded
+
+    def run(self, sleep=time.sleep):
+        """
+        Snapshot loop (no-op without a snapshot path)
+        """
+        if self.running or not self.snapshot_path or self.snapshot_interval <= 0:
+            return
+        self.running = True
+        while self.running:
+            sleep(self.snapshot_interval)
+            try:
+                self.save_snapshot()
+            except Exception as e:
+                print(f"Error saving location snapshot: {str(e)}")
+
+
+def create_location_store(cell_grid: SpatialGrid, radius_meters: float, stale_seconds: float) -> LocationStore:
+    """
+    Build the store selected by LOCATION_STORE ('postgres' or 'memory')
+    """
+    if os.getenv('LOCATION_STORE', 'postgres') == 'memory':
+        return MemoryLocationStore(
+            cell_grid,
+            stale_seconds,
+            snapshot_path=os.getenv('LOCATION_SNAPSHOT_PATH'),
+            snapshot_interval=float(os.getenv('LOCATION_SNAPSHOT_INTERVAL', 30)),
+        )
+    # Seconds between batched user_locations flushes (0 writes through on every update)
+    flush_interval = float(os.getenv('LOCATION_FLUSH_INTERVAL', 1.0))
+    return PostgresLocationStore(cell_grid, radius_meters, stale_seconds, flush_interval)
@@ -0,0 +1,111 @@
+"""
+Write-behind buffer for user_locations
+Coalesces the latest position per user and flushes everything in one
+multi-row upsert (and one multi-row delete) per interval
+"""
+import threading
+import time
+from typing import Callable, Dict, Set, Tuple
+
+from psycopg2.extras import execute_values
+
+from database import db
+
+
+class LocationWriteBuffer:
+    """
+    Pending writes keyed by user id, so only the newest state of each user
+    reaches the database. A flush_interval of 0 writes through immediately.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        # user_id -> (latitude, longitude, cell_id, updated_at epoch seconds)
+        self.pending_upserts: Dict[int, Tuple[float, float, int, float]] = {}
+        self.pending_deletes: Set[int] = set()
+        self.lock = threading.Lock()
+        self.running = False
+
+    def queue_upsert(self, user_id: int, latitude: float, longitude: float, cell_id: int) -> None:
+        """
+        Record a user's latest position, replacing anything not yet flushed
+        """
+        with self.lock:
+            self.pending_deletes.discard(user_id)
+            self.pending_upserts[user_id] = (latitude, longitude, cell_id, time.time())
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def queue_delete(self, user_id: int) -> None:
+        """
+        Record that a user's location must be removed, dropping any pending upsert
+        """
+        with self.lock:
+            self.pending_upserts.pop(user_id, None)
+            self.pending_deletes.add(user_id)
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write all pending changes in a single transaction
+        Returns the number of users written
+        """
+        with self.lock:
+            upserts, self.pending_upserts = self.pending_upserts, {}
+            deletes, self.pending_deletes = self.pending_deletes, set()
+
+        if not upserts and not deletes:
+            return 0
+
+        try:
+            with db.connection() as conn:
+                cursor = conn.cursor()
+
+                if upserts:
+                    execute_values(cursor, """
+                        INSERT INTO user_locations (user_id, latitude, longitude, cell_id, last_updated)
+                        VALUES %s
+                        ON CONFLICT (user_id)
+                        DO UPDATE SET
+                            latitude = EXCLUDED.latitude,
+                            longitude = EXCLUDED.longitude,
+                            cell_id = EXCLUDED.cell_id,
+                            last_updated = EXCLUDED.last_updated
+                    """, [
+                        (user_id, latitude, longitude, cell_id, updated_at)
+                        for user_id, (latitude, longitude, cell_id, updated_at) in upserts.items()
+                    ], template="(%s, %s, %s, %s, to_timestamp(%s))", page_size=1000)
+
+                if deletes:
+                    cursor.execute("DELETE FROM user_locations WHERE user_id = ANY(%s)", (list(deletes),))
+
+                conn.commit()
+                return len(upserts) + len(deletes)
+
+        except Exception as e:
+            # Positions are resent on the next GPS tick, but deletes are a privacy guarantee
+            print(f"Error flushing user locations: {str(e)}")
+            self._requeue_deletes(deletes)
+            return 0
+
+    def _requeue_deletes(self, deletes: Set[int]) -> None:
+        with self.lock:
+            for user_id in deletes:
+                if user_id not in self.pending_upserts:
+                    self.pending_deletes.add(user_id)
+
+    def run(self, sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        Flush loop, meant to run as a background task (pass socketio.sleep under eventlet)
+        """
+        if self.running or self.flush_interval <= 0:
+            return
+        self.running = True
+        while self.running:
+            sleep(self.flush_interval)
+            self.flush()
+
+    def stop(self) -> None:
+        self.running = False
+        self.flush()
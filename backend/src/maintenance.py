@@ -0,0 +1,120 @@
+"""
+Background maintenance: presence expiry and periodic database purges
+Positions are evicted the moment they go stale (instead of being filtered
+out by every query), and dead rows are deleted in small batches
+"""
+import heapq
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class ExpiryHeap:
+    """
+    Min-heap of (expires_at, user_id) with lazy deletion
+    Touching a user again just pushes a newer entry; superseded entries are
+    skipped when they reach the top
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[float, int]] = []
+        self.expires_at: Dict[int, float] = {}
+        self.lock = threading.Lock()
+
+    def touch(self, user_id: int, expires_at: float) -> None:
+        with self.lock:
+            self.expires_at[user_id] = expires_at
+            heapq.heappush(self.heap, (expires_at, user_id))
+
+    def discard(self, user_id: int) -> None:
+        with self.lock:
+            self.expires_at.pop(user_id, None)
+
+    def pop_expired(self, now: Optional[float] = None) -> List[int]:
+        """
+        Remove and return every user whose latest expiry has passed
+        """
+        now = time.time() if now is None else now
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                expires_at, user_id = heapq.heappop(self.heap)
+                if self.expires_at.get(user_id) == expires_at:
+                    del self.expires_at[user_id]
+                    expired.append(user_id)
+            # Superseded entries pile up under constant movement; rebuild when mostly dead
+            if len(self.heap) > 2 * len(self.expires_at) + 1024:
+                self.heap = [(expires_at, user_id) for user_id, expires_at in self.expires_at.items()]
+                heapq.heapify(self.heap)
+        return expired
+
+    def next_expiry(self) -> Optional[float]:
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+    def __len__(self) -> int:
+        return len(self.expires_at)
+
+
+class MaintenanceScheduler:
+    """
+    Evicts expired presence as it expires and runs periodic jobs
+    Jobs are (interval_seconds, fn); an interval of 0 disables the job
+    """
+
+    def __init__(self, expiry: ExpiryHeap, on_expired: Callable[[List[int]], None],
+                 jobs: Iterable[Tuple[float, Callable[[], int]]], max_sleep: float = 1.0):
+        self.expiry = expiry
+        self.on_expired = on_expired
+        self.jobs = [[interval, fn, time.time() + interval] for interval, fn in jobs if interval > 0]
+        self.max_sleep = max_sleep
+        self.running = False
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """
+        Evict expired users and run any jobs that are due
+        Returns the number of users evicted
+        """
+        now = time.time() if now is None else now
+
+        expired = self.expiry.pop_expired(now)
+        if expired:
+            try:
+                self.on_expired(expired)
+            except Exception as e:
+                print(f"Error expiring presence: {str(e)}")
+
+        for job in self.jobs:
+            interval, fn, due = job
+            if due <= now:
+                job[2] = now + interval
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"Error in maintenance job {fn.__name__}: {str(e)}")
+
+        return len(expired)
+
+    def seconds_until_next(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        deadlines = [job[2] for job in self.jobs]
+        next_expiry = self.expiry.next_expiry()
+        if next_expiry is not None:
+            deadlines.append(next_expiry)
+        if not deadlines:
+            return self.max_sleep
+        return min(self.max_sleep, max(0.0, min(deadlines) - now))
+
+    def run(self, sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        Maintenance loop, meant to run as a background task (pass socketio.sleep under eventlet)
+        """
+        if self.running:
+            return
+        self.running = True
+        while self.running:
+            sleep(self.seconds_until_next())
+            self.tick()
+
+    def stop(self) -> None:
+        self.running = False
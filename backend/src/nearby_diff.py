@@ -0,0 +1,62 @@
+"""
+Delta protocol for nearby users (location:nearby-diff)
+Tracks what each connection last received and sends only entered users
+(full profile), moved users (id + coords) and ids of users who left
+"""
+import os
+import time
+from typing import Dict, List, Optional
+
+# Seconds between forced full resyncs for diff subscribers
+DIFF_RESYNC_SECONDS = float(os.getenv('DIFF_RESYNC_SECONDS', 30))
+
+
+def profile_key(user: Dict) -> int:
+    """
+    Key that changes whenever a user edits their profile (the profile_version)
+    """
+    return user['profile_version']
+
+
+def build_nearby_diff(session, nearby_users: List[Dict], now: Optional[float] = None) -> Optional[Dict]:
+    """
+    Build the next location:nearby-diff message for a session and record it as sent
+    Returns None when nothing changed since the last message
+    """
+    if now is None:
+        now = time.time()
+
+    full = session.last_sent is None or now - session.last_resync >= DIFF_RESYNC_SECONDS
+    previous = {} if full else session.last_sent
+    current = {}
+    entered = []
+    moved = []
+
+    for user in nearby_users:
+        user_id = user['userId']
+        position = (user['latitude'], user['longitude'])
+        profile = profile_key(user)
+        current[user_id] = (position, profile)
+
+        sent = previous.get(user_id)
+        if sent is None or sent[1] != profile:
+            entered.append(user)
+        elif sent[0] != position:
+            moved.append({'userId': user_id, 'latitude': position[0], 'longitude': position[1]})
+
+    left = [user_id for user_id in previous if user_id not in current]
+
+    session.last_sent = current
+    if full:
+        session.last_resync = now
+    elif not entered and not moved and not left:
+        return None
+
+    return {'full': full, 'entered': entered, 'moved': moved, 'left': left}
+
+
+def request_resync(session) -> None:
+    """
+    Make the session's next message a full resync
+    """
+    session.last_sent = None
@@ -0,0 +1,108 @@
+"""
+Bounded worker pool for bcrypt
+bcrypt deliberately takes hundreds of milliseconds, so it runs on native
+threads (eventlet's tpool when the worker is monkey patched) and callers past
+the queue limit are turned away instead of piling up
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt off the request thread with at most `workers` hashes in flight
+    and `max_queue` callers waiting for one
+    """
+
+    def __init__(self, workers: int, max_queue: int, rounds: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rounds = rounds
+        self.slots = threading.BoundedSemaphore(workers)
+        self.executor = None
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _execute(self, fn: Callable, *args):
+        eventlet = sys.modules.get('eventlet')
+        if eventlet is not None and eventlet.patcher.is_monkey_patched('thread'):
+            # Threads are green here, only tpool reaches a real OS thread
+            from eventlet import tpool
+            return tpool.execute(fn, *args)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+        return self.executor.submit(fn, *args).result()
+
+    def _run(self, fn: Callable, *args):
+        with self.lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise PasswordHasherBusy('Password hashing queue is full')
+            self.waiting += 1
+
+        started = time.monotonic()
+        try:
+            self.slots.acquire()
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+        try:
+            with self.lock:
+                self.active += 1
+            return self._execute(fn, *args)
+        finally:
+            elapsed = time.monotonic() - started
+            self.slots.release()
+            with self.lock:
+                self.active -= 1
+                self.completed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+
+    def hash(self, password: str) -> str:
+        hashed = self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds))
+        return hashed.decode('utf-8')
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def stats(self) -> Dict:
+        """
+        Queue depth and latency (including time spent waiting for a worker)
+        """
+        with self.lock:
+            return {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'active': self.active,
+                'waiting': self.waiting,
+                'max_queue': self.max_queue,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_ms': round(1000 * self.total_seconds / self.completed, 2) if self.completed else 0.0,
+                'max_ms': round(1000 * self.max_seconds, 2),
+            }
+
+
+# Global hasher instance
+password_hasher = PasswordHasher(
+    int(os.getenv('BCRYPT_WORKERS', 4)),
+    int(os.getenv('BCRYPT_MAX_QUEUE', 64)),
+    int(os.getenv('BCRYPT_ROUNDS', 12)),
+)
@@ -0,0 +1,492 @@
+"""
+Pluggable presence backends
+A presence backend holds who is where, the proximity graph, and a small
+pub/sub channel, so several workers (or nodes) can serve one city
+
+local: in-process spatial index + graph (single worker, and tests)
+shm: memory-mapped presence segment shared by the workers on one host
+redis: Redis GEO set + adjacency sets + pub/sub, shared by every worker
+sharded: map regions split across several of the above (see geo_sharding)
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+from geo import within_proximity_mask
+from proximity_graph import ProximityGraph
+from spatial_index import SpatialGrid, cell_to_id
+
+
+# Identifies this process in published messages
+PROCESS_ID = uuid.uuid4().hex
+
+# Backoff between attempts to resubscribe after the Redis pub/sub connection drops
+REDIS_RECONNECT_MIN_SECONDS = float(os.getenv('PRESENCE_REDIS_RECONNECT_MIN', 0.5))
+REDIS_RECONNECT_MAX_SECONDS = float(os.getenv('PRESENCE_REDIS_RECONNECT_MAX', 30))
+
+
+class PresenceBackend(ABC):
+    """
+    Interface every presence backend implements
+    """
+
+    def __init__(self):
+        self.subscribers: Dict[str, List[Callable]] = {}
+
+    @abstractmethod
+    def update(self, user_id: int, latitude: float, longitude: float) -> None:
+        """
+        Publish a user's latest position
+        """
+
+    @abstractmethod
+    def remove(self, user_id: int) -> Set[int]:
+        """
+        Drop a user's position and graph edges, returning their former neighbors
+        """
+
+    @abstractmethod
+    def nearby_positions(self, user_id: int, latitude: float, longitude: float) -> Dict[int, Tuple[float, float]]:
+        """
+        Get {user_id: (latitude, longitude)} for fresh users within proximity, excluding user_id
+        """
+
+    @abstractmethod
+    def positions(self, user_ids: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+        """
+        Get {user_id: (latitude, longitude)} for the fresh users among user_ids
+        """
+
+    @abstractmethod
+    def set_neighbors(self, user_id: int, neighbor_ids: Iterable[int]) -> Tuple[Set[int], Set[int]]:
+        """
+        Replace a user's proximity edges, returning (added, removed)
+        """
+
+    @abstractmethod
+    def neighbors(self, user_id: int) -> Set[int]:
+        """
+        Get the ids currently within a user's proximity
+        """
+
+    def neighbors_many(self, user_ids: Iterable[int]) -> Dict[int, Set[int]]:
+        """
+        Get {user_id: neighbor ids} for several users
+        Backends override this when a batch is cheaper than one lookup per user
+        """
+        return {user_id: self.neighbors(user_id) for user_id in user_ids}
+
+    @abstractmethod
+    def publish(self, channel: str, message) -> None:
+        """
+        Send a message to every subscriber of channel, in every worker
+        """
+
+    def purge_stale(self, batch_size: int) -> Dict[int, Set[int]]:
+        """
+        Drop positions nobody will evict on their own (e.g. written by a worker
+        that crashed), returning {removed user_id: former neighbors}
+        Backends whose stale entries are evicted or reused in place have nothing to do
+        """
+        return {}
+
+    def subscribe(self, channel: str, callback: Callable) -> None:
+        self.subscribers.setdefault(channel, []).append(callback)
+
+    def start(self, start_background_task: Callable) -> None:
+        """
+        Start any listeners the backend needs (pass socketio.start_background_task)
+        """
+
+    def _deliver(self, channel: str, message) -> None:
+        for callback in self.subscribers.get(channel, ()):
+            try:
+                callback(message)
+            except Exception as e:
+                print(f"Error handling presence message on {channel}: {str(e)}")
+
+
+class LocalPresenceBackend(PresenceBackend):
+    """
+    Everything in this process: SpatialGrid positions + ProximityGraph edges
+    Seeded once from user_locations so a restart doesn't hide users until they move
+    """
+
+    def __init__(self, spatial_index, proximity_graph, stale_seconds: float, expiry=None, store=None):
+        super().__init__()
+        self.spatial_index = spatial_index
+        self.proximity_graph = proximity_graph
+        self.stale_seconds = stale_seconds
+        # Seeded positions are scheduled for eviction like any other write
+        self.expiry = expiry
+        self.store = store
+        self.loaded = False
+        self.load_lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Seed the spatial index from the location store's fresh entries (once per process)
+        """
+        if self.loaded:
+            return
+
+        with self.load_lock:
+            if self.loaded:
+                return
+
+            if self.store is None:
+                self.loaded = True
+                return
+
+            try:
+                for user_id, latitude, longitude, updated_at in self.store.fresh_locations():
+                    self.spatial_index.update(user_id, latitude, longitude, updated_at)
+                    if self.expiry is not None:
+                        self.expiry.touch(user_id, updated_at + self.stale_seconds)
+                self.loaded = True
+            except Exception as e:
+                print(f"Error loading spatial index: {str(e)}")
+
+    def update(self, user_id, latitude, longitude):
+        self.spatial_index.update(user_id, latitude, longitude)
+
+    def remove(self, user_id):
+        self.spatial_index.remove(user_id)
+        return self.proximity_graph.remove(user_id)
+
+    def nearby_positions(self, user_id, latitude, longitude):
+        self.load()
+        # Only the 3x3 cells around the user can hold someone within the radius
+        return self.spatial_index.nearby_positions(user_id, latitude, longitude, self.stale_seconds)
+
+    def positions(self, user_ids):
+        return self.spatial_index.fresh_positions(user_ids, self.stale_seconds)
+
+    def set_neighbors(self, user_id, neighbor_ids):
+        return self.proximity_graph.set_neighbors(user_id, neighbor_ids)
+
+    def neighbors(self, user_id):
+        return self.proximity_graph.neighbors(user_id)
+
+    def publish(self, channel, message):
+        # Single process: subscribers are all local
+        self._deliver(channel, message)
+
+
+class SharedMemoryPresenceBackend(PresenceBackend):
+    """
+    Positions in a SharedPresenceSegment that every local worker maps
+    Neighbor sets are computed from the segment when asked, so they are the
+    same in every worker; each worker only remembers its own movers' last
+    neighbor set to report who departed
+    """
+
+    def __init__(self, spatial_index, path: str, capacity: int, stale_seconds: float, bucket_slots: int = 256):
+        super().__init__()
+        from shared_presence import LocalSocketBus, SharedPresenceSegment
+
+        self.spatial_index = spatial_index
+        self.segment = SharedPresenceSegment(path, capacity, bucket_slots)
+        self.bus = LocalSocketBus(f'{path}.d')
+        self.bus.bind()
+        self.stale_seconds = stale_seconds
+        self.last_neighbors: Dict[int, Set[int]] = {}
+
+    def _cutoff_ms(self) -> int:
+        return int((time.time() - self.stale_seconds) * 1000)
+
+    def update(self, user_id, latitude, longitude):
+        cell_id = cell_to_id(self.spatial_index.cell_for(latitude, longitude))
+        self.segment.write(user_id, latitude, longitude, int(time.time() * 1000), cell_id, self._cutoff_ms())
+
+    def remove(self, user_id):
+        former = self.neighbors(user_id) | self.last_neighbors.pop(user_id, set())
+        self.segment.clear(user_id)
+        return former
+
+    def nearby_positions(self, user_id, latitude, longitude):
+        cell_ids = [cell_to_id(cell) for cell in self.spatial_index.neighboring_cells(latitude, longitude)]
+        rows = self.segment.in_cells(cell_ids, self._cutoff_ms())
+        rows = rows[rows['user_id'] != user_id]
+        if not len(rows):
+            return {}
+
+        mask = within_proximity_mask(latitude, longitude, rows['latitude'], rows['longitude'])
+        return {
+            int(row['user_id']): (float(row['latitude']), float(row['longitude']))
+            for row in rows[mask]
+        }
+
+    def positions(self, user_ids):
+        rows = self.segment.read(user_ids)
+        cutoff_ms = self._cutoff_ms()
+        return {
+            int(row['user_id']): (float(row['latitude']), float(row['longitude']))
+            for row in rows if row['updated_at'] >= cutoff_ms
+        }
+
+    def set_neighbors(self, user_id, neighbor_ids):
+        new_neighbors = set(neighbor_ids)
+        new_neighbors.discard(user_id)
+        previous = self.last_neighbors.get(user_id, set())
+        self.last_neighbors[user_id] = new_neighbors
+        return new_neighbors - previous, previous - new_neighbors
+
+    def neighbors(self, user_id):
+        return self.neighbors_many([user_id])[user_id]
+
+    def neighbors_many(self, user_ids):
+        """
+        One segment read for every recipient's position and one scan over the
+        union of their cell buckets, then a vectorized distance check per recipient
+        """
+        user_ids = list(user_ids)
+        neighborhoods = {user_id: set() for user_id in user_ids}
+        positions = self.positions(user_ids)
+        if not positions:
+            return neighborhoods
+
+        recipient_cells = {
+            user_id: [cell_to_id(cell) for cell in self.spatial_index.neighboring_cells(*position)]
+            for user_id, position in positions.items()
+        }
+        rows = self.segment.in_cells(sorted(set().union(*recipient_cells.values())), self._cutoff_ms())
+        if not len(rows):
+            return neighborhoods
+
+        for user_id, cell_ids in recipient_cells.items():
+            candidates = rows[np.isin(rows['cell_id'], cell_ids) & (rows['user_id'] != user_id)]
+            if not len(candidates):
+                continue
+            mask = within_proximity_mask(*positions[user_id], candidates['latitude'], candidates['longitude'])
+            neighborhoods[user_id] = {int(other_id) for other_id in candidates['user_id'][mask]}
+        return neighborhoods
+
+    def publish(self, channel, message):
+        self.bus.publish(channel, message)
+
+    def start(self, start_background_task):
+        start_background_task(self.bus.listen, self._deliver)
+
+
+class RedisPresenceBackend(PresenceBackend):
+    """
+    Shared presence in Redis (6.2+ for GEOSEARCH / ZMSCORE):
+    a GEO set of positions, a sorted set of last-seen times, one SET of
+    neighbor ids per user, and pub/sub channels under the same prefix
+    """
+
+    def __init__(self, url: str, radius_meters: float, stale_seconds: float, prefix: str = 'chickalo'):
+        super().__init__()
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.radius_meters = radius_meters
+        self.stale_seconds = stale_seconds
+        self.prefix = prefix
+        self.geo_key = f'{prefix}:presence:geo'
+        self.seen_key = f'{prefix}:presence:seen'
+
+    def _neighbors_key(self, user_id: int) -> str:
+        return f'{self.prefix}:presence:neighbors:{user_id}'
+
+    def _channel(self, channel: str) -> str:
+        return f'{self.prefix}:channel:{channel}'
+
+    def update(self, user_id, latitude, longitude):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.geoadd(self.geo_key, (longitude, latitude, user_id))
+        pipe.zadd(self.seen_key, {user_id: time.time()})
+        pipe.execute()
+
+    def remove(self, user_id):
+        former = {int(member) for member in self.redis.smembers(self._neighbors_key(user_id))}
+        pipe = self.redis.pipeline(transaction=False)
+        for other_id in former:
+            pipe.srem(self._neighbors_key(other_id), user_id)
+        pipe.delete(self._neighbors_key(user_id))
+        pipe.zrem(self.geo_key, user_id)
+        pipe.zrem(self.seen_key, user_id)
+        pipe.execute()
+        return former
+
+    def _fresh(self, user_ids: List[int]) -> List[bool]:
+        if not user_ids:
+            return []
+        cutoff = time.time() - self.stale_seconds
+        return [seen is not None and seen >= cutoff for seen in self.redis.zmscore(self.seen_key, user_ids)]
+
+    def nearby_positions(self, user_id, latitude, longitude):
+        # Redis uses a slightly different Earth radius, so search a little wider
+        # and let the shared haversine make the final call
+        results = self.redis.geosearch(
+            self.geo_key, longitude=longitude, latitude=latitude,
+            radius=self.radius_meters * 1.01, unit='m', withcoord=True
+        )
+        candidates = [(int(member), lon, lat) for member, (lon, lat) in results if int(member) != user_id]
+        if not candidates:
+            return {}
+
+        fresh = self._fresh([other_id for other_id, _, _ in candidates])
+        candidates = [candidate for candidate, is_fresh in zip(candidates, fresh) if is_fresh]
+        if not candidates:
+            return {}
+
+        latitudes = np.array([lat for _, _, lat in candidates], dtype=np.float64)
+        longitudes = np.array([lon for _, lon, _ in candidates], dtype=np.float64)
+        mask = within_proximity_mask(latitude, longitude, latitudes, longitudes)
+        return {
+            other_id: (lat, lon)
+            for (other_id, lon, lat), inside in zip(candidates, mask) if inside
+        }
+
+    def positions(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        coordinates = self.redis.geopos(self.geo_key, *user_ids)
+        fresh = self._fresh(user_ids)
+        return {
+            user_id: (coordinate[1], coordinate[0])
+            for user_id, coordinate, is_fresh in zip(user_ids, coordinates, fresh)
+            if coordinate and is_fresh
+        }
+
+    def set_neighbors(self, user_id, neighbor_ids):
+        new_neighbors = set(neighbor_ids)
+        new_neighbors.discard(user_id)
+        current = {int(member) for member in self.redis.smembers(self._neighbors_key(user_id))}
+        added = new_neighbors - current
+        removed = current - new_neighbors
+
+        if added or removed:
+            pipe = self.redis.pipeline(transaction=False)
+            if added:
+                pipe.sadd(self._neighbors_key(user_id), *added)
+            if removed:
+                pipe.srem(self._neighbors_key(user_id), *removed)
+            for other_id in added:
+                pipe.sadd(self._neighbors_key(other_id), user_id)
+            for other_id in removed:
+                pipe.srem(self._neighbors_key(other_id), user_id)
+            pipe.execute()
+
+        return added, removed
+
+    def neighbors(self, user_id):
+        return {int(member) for member in self.redis.smembers(self._neighbors_key(user_id))}
+
+    def neighbors_many(self, user_ids):
+        user_ids = list(user_ids)
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.smembers(self._neighbors_key(user_id))
+        return {
+            user_id: {int(member) for member in members}
+            for user_id, members in zip(user_ids, pipe.execute())
+        }
+
+    def publish(self, channel, message):
+        self.redis.publish(self._channel(channel), json.dumps(message))
+
+    def purge_stale(self, batch_size):
+        """
+        Positions are only removed by the worker that wrote them, so a crashed
+        worker's users would stay in the GEO set forever; any worker sweeps
+        them by last-seen time, one batch per round trip
+        """
+        removed = {}
+        cutoff = time.time() - self.stale_seconds
+        while True:
+            stale = [int(member) for member in
+                     self.redis.zrangebyscore(self.seen_key, '-inf', cutoff, start=0, num=batch_size)]
+            if not stale:
+                break
+            # Skip anyone who moved again since the range was read
+            for user_id, is_fresh in zip(stale, self._fresh(stale)):
+                if not is_fresh:
+                    removed[user_id] = self.remove(user_id)
+            if len(stale) < batch_size:
+                break
+        return removed
+
+    def start(self, start_background_task):
+        if not self.subscribers:
+            return
+        start_background_task(self._listen)
+
+    def _listen(self, sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        Deliver pub/sub messages, resubscribing with backoff whenever the
+        connection drops (messages published while disconnected are lost)
+        """
+        prefix = self._channel('')
+        backoff = REDIS_RECONNECT_MIN_SECONDS
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(*[self._channel(channel) for channel in self.subscribers])
+                backoff = REDIS_RECONNECT_MIN_SECONDS
+                for item in pubsub.listen():
+                    channel = item['channel'].decode('utf-8')[len(prefix):]
+                    try:
+                        message = json.loads(item['data'])
+                    except ValueError as e:
+                        print(f"Error decoding presence message on {channel}: {str(e)}")
+                        continue
+                    self._deliver(channel, message)
+                print("Presence listener disconnected from Redis")
+            except Exception as e:
+                print(f"Error in presence listener: {str(e)}")
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+            print(f"Resubscribing presence listener in {backoff:.1f}s")
+            sleep(backoff)
+            backoff = min(backoff * 2, REDIS_RECONNECT_MAX_SECONDS)
+
+
+def _create_shard(url: str, radius_meters: float, stale_seconds: float, prefix: str) -> PresenceBackend:
+    """
+    'local' gives an in-process stand-in shard, anything else is a Redis URL
+    """
+    if url == 'local':
+        shard = LocalPresenceBackend(SpatialGrid(radius_meters), ProximityGraph(), stale_seconds)
+        shard.loaded = True  # shards are filled by routed updates, not the table seed
+        return shard
+    return RedisPresenceBackend(url, radius_meters, stale_seconds, prefix=prefix)
+
+
+def create_presence_backend(spatial_index, proximity_graph, radius_meters: float, stale_seconds: float,
+                            expiry=None, store=None) -> PresenceBackend:
+    """
+    Build the backend selected by PRESENCE_BACKEND ('local', 'shm', 'redis' or 'sharded')
+    """
+    backend = os.getenv('PRESENCE_BACKEND', 'local')
+    if backend == 'sharded':
+        from geo_sharding import ShardMap, ShardedPresenceBackend
+
+        urls = [url.strip() for url in os.getenv('PRESENCE_SHARD_URLS', 'local,local').split(',')]
+        region_degrees = float(os.getenv('PRESENCE_REGION_DEGREES', 0.05))
+        shards = [_create_shard(url, radius_meters, stale_seconds, f'chickalo:shard{i}') for i, url in enumerate(urls)]
+        graph_backend = _create_shard(urls[0], radius_meters, stale_seconds, 'chickalo:graph')
+        return ShardedPresenceBackend(ShardMap(len(shards), region_degrees, radius_meters), shards, graph_backend)
+    if backend == 'shm':
+        path = os.getenv('PRESENCE_SHM_PATH', '/dev/shm/chickalo-presence')
+        capacity = int(os.getenv('PRESENCE_SHM_CAPACITY', 65536))
+        # Records per cell bucket; a nearby query reads the buckets of 9 cells
+        bucket_slots = int(os.getenv('PRESENCE_SHM_BUCKET_SLOTS', 256))
+        return SharedMemoryPresenceBackend(spatial_index, path, capacity, stale_seconds, bucket_slots)
+    if backend == 'redis':
+        url = os.getenv('PRESENCE_REDIS_URL', 'redis://localhost:6379/0')
+        return RedisPresenceBackend(url, radius_meters, stale_seconds)
+    return LocalPresenceBackend(spatial_index, proximity_graph, stale_seconds, expiry=expiry, store=store)
@@ -0,0 +1,72 @@
+"""
+Symmetric proximity graph for real-time location updates
+Keeps an adjacency set per user so a mover's update only touches its own edges
+and every recipient's nearby list can be read straight from the graph
+"""
+import threading
+from typing import Dict, Iterable, Set, Tuple
+
+
+class ProximityGraph:
+    """
+    Undirected graph of users currently within proximity of each other
+    Edges are only changed for the user that moved (or left)
+    """
+
+    def __init__(self):
+        self.adjacency: Dict[int, Set[int]] = {}
+        self.lock = threading.Lock()
+
+    def set_neighbors(self, user_id: int, neighbor_ids: Iterable[int]) -> Tuple[Set[int], Set[int]]:
+        """
+        Replace a user's neighbor set, mirroring every change on the other side
+        Returns (added, removed) neighbor ids
+        """
+        new_neighbors = set(neighbor_ids)
+        new_neighbors.discard(user_id)
+
+        with self.lock:
+            current = self.adjacency.get(user_id, set())
+            added = new_neighbors - current
+            removed = current - new_neighbors
+
+            for other_id in added:
+                self.adjacency.setdefault(other_id, set()).add(user_id)
+            for other_id in removed:
+                self._discard_edge(other_id, user_id)
+
+            if new_neighbors:
+                self.adjacency[user_id] = new_neighbors
+            else:
+                self.adjacency.pop(user_id, None)
+
+        return added, removed
+
+    def remove(self, user_id: int) -> Set[int]:
+        """
+        Drop a user and all of their edges
+        Returns the ids of their former neighbors
+        """
+        with self.lock:
+            former = self.adjacency.pop(user_id, set())
+            for other_id in former:
+                self._discard_edge(other_id, user_id)
+        return former
+
+    def _discard_edge(self, user_id: int, other_id: int) -> None:
+        neighbors = self.adjacency.get(user_id)
+        if neighbors is None:
+            return
+        neighbors.discard(other_id)
+        if not neighbors:
+            del self.adjacency[user_id]
+
+    def neighbors(self, user_id: int) -> Set[int]:
+        """
+        Get a copy of a user's current neighbor set
+        """
+        with self.lock:
+            return set(self.adjacency.get(user_id, ()))
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.adjacency
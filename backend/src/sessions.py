@@ -0,0 +1,98 @@
+"""
+Per-connection session state for Socket.IO clients
+Created once when a socket authenticates so location handlers never
+re-verify tokens or trust a user_id from the event payload
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class SocketSession:
+    """
+    Compact record of one authenticated socket
+    """
+    __slots__ = ('sid', 'user_id', 'is_active', 'latitude', 'longitude', 'cell', 'last_emit',
+                 'protocol', 'last_sent', 'last_resync', 'encoding', 'sent_profiles',
+                 'last_ingest', 'last_client_timestamp', 'pending_update', 'pending_scheduled',
+                 'positions_only')
+
+    def __init__(self, sid: str, user_id: int, is_active: bool = False):
+        self.sid = sid
+        self.user_id = user_id
+        self.is_active = is_active
+        self.latitude: Optional[float] = None
+        self.longitude: Optional[float] = None
+        self.cell: Optional[Tuple[int, int]] = None
+        self.last_emit = 0.0
+        # 'full' sends location:nearby-users, 'diff' sends location:nearby-diff
+        self.protocol = 'full'
+        # user_id -> (position, profile) last sent to a diff subscriber
+        self.last_sent: Optional[Dict] = None
+        self.last_resync = 0.0
+        # 'json' or 'binary' (see wire_format) for location:update / location:nearby-users
+        self.encoding = 'json'
+        # user_id -> profile version already sent to a binary client
+        self.sent_profiles: Dict[int, int] = {}
+        # JSON clients that fetch profiles themselves get ids, coords and versions only
+        self.positions_only = False
+        # Ingest throttling (see ingest_throttle): last accepted update and the
+        # latest update of a burst still waiting for the interval to pass
+        self.last_ingest = 0.0
+        self.last_client_timestamp: Optional[float] = None
+        self.pending_update: Optional[Tuple[float, float, Optional[float]]] = None
+        self.pending_scheduled = False
+
+
+class SessionRegistry:
+    """
+    sid -> session, plus user_id -> every connected sid of that user
+    """
+
+    def __init__(self):
+        self.by_sid: Dict[str, SocketSession] = {}
+        # Insertion-ordered, so the last sid is the user's most recent socket
+        self.by_user: Dict[int, Dict[str, None]] = {}
+        self.lock = threading.Lock()
+
+    def create(self, sid: str, user_id: int, is_active: bool = False) -> SocketSession:
+        session = SocketSession(sid, user_id, is_active)
+        with self.lock:
+            self.by_sid[sid] = session
+            self.by_user.setdefault(user_id, {})[sid] = None
+        return session
+
+    def get(self, sid: str) -> Optional[SocketSession]:
+        return self.by_sid.get(sid)
+
+    def for_user(self, user_id: int) -> Optional[SocketSession]:
+        """
+        Session of the user's most recent socket still connected
+        """
+        with self.lock:
+            sids = self.by_user.get(user_id)
+            return self.by_sid.get(next(reversed(sids))) if sids else None
+
+    def all_for_user(self, user_id: int) -> List[SocketSession]:
+        with self.lock:
+            return [self.by_sid[sid] for sid in self.by_user.get(user_id, ()) if sid in self.by_sid]
+
+    def remove(self, sid: str) -> Optional[SocketSession]:
+        """
+        Drop a socket's session
+        The user mapping is only cleared once the user's last socket is gone
+        """
+        with self.lock:
+            session = self.by_sid.pop(sid, None)
+            if session:
+                sids = self.by_user.get(session.user_id, {})
+                sids.pop(sid, None)
+                if not sids:
+                    self.by_user.pop(session.user_id, None)
+        return session
+
+    def __len__(self) -> int:
+        return len(self.by_sid)
+
+
+# Global session registry
+sessions = SessionRegistry()
@@ -0,0 +1,404 @@
+"""
+Shared-memory presence segment for multi-worker single-host deployments
+Every worker maps the same file of fixed-size records, the worker that owns a
+user's socket writes that user's record, and all workers read positions in place
+
+Layout: header, per-bucket spill counts, records, then a user_id -> slot directory
+Records are grouped into buckets by cell, so a nearby query only reads the
+buckets of the 3x3 cells around a point instead of the whole segment
+
+Record (48 bytes): seq, user_id, latitude, longitude, updated_at (ms), cell_id
+seq is a seqlock: odd while a write is in progress, bumped twice per write
+"""
+import fcntl
+import glob
+import json
+import os
+import socket
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+RECORD_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('user_id', '<i8'),
+    ('latitude', '<f8'),
+    ('longitude', '<f8'),
+    ('updated_at', '<i8'),
+    ('cell_id', '<i8'),
+])
+
+DIRECTORY_DTYPE = np.dtype([
+    ('user_id', '<i8'),
+    ('slot', '<i8'),
+])
+
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u8'),
+    ('bucket_count', '<i8'),
+    ('bucket_slots', '<i8'),
+])
+
+# Bumped whenever the file layout changes, so a stale file is reinitialized
+SEGMENT_MAGIC = 0x43484B5052455302  # 'CHKPRES' + layout version 2
+
+# user_id markers (real ids start at 1)
+EMPTY_SLOT = 0
+TOMBSTONE = -1
+
+# Reads retry this many times before giving up on a record that keeps changing
+SEQLOCK_RETRIES = 3
+
+
+def _mix(value: int) -> int:
+    """
+    64-bit multiplicative hash (neighboring cells and sequential ids spread out)
+    """
+    return ((value * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 16
+
+
+class SharedPresenceSegment:
+    """
+    Presence records in a memory-mapped file, bucketed by cell
+    A user's record lives in their cell's bucket (or, when that bucket is
+    full, a following bucket recorded in the bucket's spill count), and the
+    directory maps user ids to slots for lookups by id
+    Slot claims, moves between buckets and clears take a file lock; position
+    writes within a bucket and all reads are lock-free
+    """
+
+    def __init__(self, path: str, capacity: int, bucket_slots: int = 256):
+        self.path = path
+        self.bucket_slots = min(bucket_slots, capacity)
+        self.bucket_count = max(1, capacity // self.bucket_slots)
+        self.capacity = self.bucket_count * self.bucket_slots
+        self.directory_capacity = 2 * self.capacity
+        self.lock_fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        spill_offset = HEADER_DTYPE.itemsize
+        records_offset = spill_offset + 8 * self.bucket_count
+        directory_offset = records_offset + RECORD_DTYPE.itemsize * self.capacity
+        size = directory_offset + DIRECTORY_DTYPE.itemsize * self.directory_capacity
+
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            header = self._read_header(size)
+            if header != (SEGMENT_MAGIC, self.bucket_count, self.bucket_slots):
+                # New file, or one written with another layout: start from zeros
+                os.ftruncate(self.lock_fd, 0)
+                os.ftruncate(self.lock_fd, size)
+                header_map = np.memmap(path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+                header_map[0] = (SEGMENT_MAGIC, self.bucket_count, self.bucket_slots)
+                header_map.flush()
+                del header_map
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+        self.spill = np.memmap(path, dtype='<i8', mode='r+', offset=spill_offset, shape=(self.bucket_count,))
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r+', offset=records_offset, shape=(self.capacity,))
+        self.records = records
+        # Column views into the mapping (no copies)
+        self.seq = records['seq']
+        self.user_ids = records['user_id']
+        self.latitudes = records['latitude']
+        self.longitudes = records['longitude']
+        self.updated_at = records['updated_at']
+        self.cell_ids = records['cell_id']
+        directory = np.memmap(path, dtype=DIRECTORY_DTYPE, mode='r+', offset=directory_offset,
+                              shape=(self.directory_capacity,))
+        self.directory_user_ids = directory['user_id']
+        self.directory_slots = directory['slot']
+        # user_id -> slot for users this process has looked up
+        self.slots: Dict[int, int] = {}
+
+    def _read_header(self, size: int) -> Optional[Tuple[int, int, int]]:
+        if os.fstat(self.lock_fd).st_size != size:
+            return None
+        raw = os.pread(self.lock_fd, HEADER_DTYPE.itemsize, 0)
+        header = np.frombuffer(raw, dtype=HEADER_DTYPE)[0]
+        return int(header['magic']), int(header['bucket_count']), int(header['bucket_slots'])
+
+    # Buckets
+
+    def bucket_of_cell(self, cell_id: int) -> int:
+        return _mix(cell_id) % self.bucket_count
+
+    def _bucket_range(self, bucket: int) -> List[int]:
+        """
+        Buckets that may hold records of cells hashed to bucket (itself plus its spill)
+        """
+        return [(bucket + offset) % self.bucket_count for offset in range(int(self.spill[bucket]) + 1)]
+
+    def _slots_of_buckets(self, buckets: Iterable[int]) -> np.ndarray:
+        size = self.bucket_slots
+        return np.concatenate([np.arange(bucket * size, (bucket + 1) * size) for bucket in buckets])
+
+    def _slot_serves_cell(self, slot: int, cell_id: int) -> bool:
+        bucket = self.bucket_of_cell(cell_id)
+        return (slot // self.bucket_slots - bucket) % self.bucket_count <= self.spill[bucket]
+
+    # Directory
+
+    def _directory_probe(self, user_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Get (index of the user's directory entry, first reusable index on the way)
+        """
+        index = _mix(user_id) % self.directory_capacity
+        reusable = None
+        for _ in range(self.directory_capacity):
+            current = self.directory_user_ids[index]
+            if current == user_id:
+                return index, reusable
+            if current == EMPTY_SLOT:
+                return None, index if reusable is None else reusable
+            if current == TOMBSTONE and reusable is None:
+                reusable = index
+            index = (index + 1) % self.directory_capacity
+        return None, reusable
+
+    def _directory_set(self, user_id: int, slot: int) -> None:
+        """
+        Point a user's entry at slot (caller holds the file lock)
+        """
+        index, reusable = self._directory_probe(user_id)
+        if index is None:
+            index = reusable
+            # Slot first, so a reader that sees the id also sees where it points
+            self.directory_slots[index] = slot
+            self.directory_user_ids[index] = user_id
+        else:
+            self.directory_slots[index] = slot
+
+    def _directory_clear(self, user_id: int) -> None:
+        index, _ = self._directory_probe(user_id)
+        if index is not None:
+            self.directory_user_ids[index] = TOMBSTONE
+
+    def find(self, user_id: int) -> Optional[int]:
+        """
+        Get a user's slot, checking the cached slot still belongs to them
+        """
+        slot = self.slots.get(user_id)
+        if slot is not None and self.user_ids[slot] == user_id:
+            return slot
+        # A concurrent move can retire the slot between the two reads; look again once
+        for _ in range(2):
+            index, _ = self._directory_probe(user_id)
+            if index is None:
+                break
+            slot = int(self.directory_slots[index])
+            if self.user_ids[slot] == user_id:
+                self.slots[user_id] = slot
+                return slot
+        self.slots.pop(user_id, None)
+        return None
+
+    # Writes
+
+    def _write_record(self, slot: int, user_id: int, latitude: float, longitude: float,
+                      updated_at_ms: int, cell_id: int) -> None:
+        self.seq[slot] += 1
+        self.user_ids[slot] = user_id
+        self.latitudes[slot] = latitude
+        self.longitudes[slot] = longitude
+        self.updated_at[slot] = updated_at_ms
+        self.cell_ids[slot] = cell_id
+        self.seq[slot] += 1
+
+    def _retire(self, slot: int) -> None:
+        self.seq[slot] += 1
+        self.user_ids[slot] = TOMBSTONE
+        self.seq[slot] += 1
+
+    def _claim(self, user_id: int, cell_id: int, reclaim_before_ms: int) -> Optional[int]:
+        """
+        Find a free slot for cell_id's bucket, spilling into following buckets
+        when it is full (caller holds the file lock)
+        """
+        bucket = self.bucket_of_cell(cell_id)
+        size = self.bucket_slots
+        start = _mix(user_id) % size
+        for offset in range(self.bucket_count):
+            base = ((bucket + offset) % self.bucket_count) * size
+            order = base + (start + np.arange(size)) % size
+            current = self.user_ids[order]
+            reusable = (current == EMPTY_SLOT) | (current == TOMBSTONE) | (
+                (current > 0) & (self.updated_at[order] < reclaim_before_ms))
+            free = np.flatnonzero(reusable)
+            if not len(free):
+                continue
+            slot = int(order[free[0]])
+            evicted = int(self.user_ids[slot])
+            if evicted > 0:
+                self._directory_clear(evicted)
+            if offset > self.spill[bucket]:
+                self.spill[bucket] = offset
+            return slot
+        return None
+
+    def write(self, user_id: int, latitude: float, longitude: float,
+              updated_at_ms: int, cell_id: int, reclaim_before_ms: int) -> bool:
+        """
+        Publish a user's position (only the user's owning worker should call this)
+        """
+        slot = self.find(user_id)
+        if slot is not None and self._slot_serves_cell(slot, cell_id):
+            self._write_record(slot, user_id, latitude, longitude, updated_at_ms, cell_id)
+            return True
+
+        # First write, or the user moved to a cell served by another bucket
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            new_slot = self._claim(user_id, cell_id, reclaim_before_ms)
+            if new_slot is None:
+                print("Shared presence segment is full")
+                return False
+            # New record, then the directory, then retire the old record, so
+            # readers always find one of the two
+            self._write_record(new_slot, user_id, latitude, longitude, updated_at_ms, cell_id)
+            self._directory_set(user_id, new_slot)
+            if slot is not None and self.user_ids[slot] == user_id:
+                self._retire(slot)
+            self.slots[user_id] = new_slot
+            return True
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def clear(self, user_id: int) -> None:
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            slot = self.find(user_id)
+            self._directory_clear(user_id)
+            if slot is not None:
+                self._retire(slot)
+            self.slots.pop(user_id, None)
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    # Reads
+
+    def _read_rows(self, slots: np.ndarray) -> np.ndarray:
+        """
+        Copy out consistent records for the given slots, dropping any that
+        were mid-write on every attempt
+        """
+        rows = self.records[slots]
+        consistent = (rows['seq'] % 2 == 0) & (rows['seq'] == self.seq[slots])
+        for _ in range(SEQLOCK_RETRIES):
+            if consistent.all():
+                break
+            retry = slots[~consistent]
+            rows[~consistent] = self.records[retry]
+            consistent = (rows['seq'] % 2 == 0) & (rows['seq'] == self.seq[slots])
+        return rows[consistent]
+
+    def read(self, user_ids: Iterable[int]) -> np.ndarray:
+        """
+        Get consistent records for the given users (missing users are skipped)
+        """
+        slots = [slot for slot in (self.find(user_id) for user_id in user_ids) if slot is not None]
+        if not slots:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        rows = self._read_rows(np.array(slots, dtype=np.int64))
+        return rows[rows['user_id'] > 0]
+
+    def in_cells(self, cell_ids: List[int], fresh_after_ms: int) -> np.ndarray:
+        """
+        Get consistent, fresh records whose cell is one of cell_ids
+        Only the buckets serving those cells are read
+        """
+        buckets = set()
+        for cell_id in cell_ids:
+            buckets.update(self._bucket_range(self.bucket_of_cell(cell_id)))
+        slots = self._slots_of_buckets(sorted(buckets))
+
+        mask = (self.user_ids[slots] > 0) & (self.updated_at[slots] >= fresh_after_ms)
+        mask &= np.isin(self.cell_ids[slots], cell_ids)
+        slots = slots[mask]
+        if not len(slots):
+            return np.empty(0, dtype=RECORD_DTYPE)
+        rows = self._read_rows(slots)
+        return rows[(rows['user_id'] > 0) & np.isin(rows['cell_id'], cell_ids)]
+
+
+# Largest datagram a listener reads; bigger list messages are split before sending
+MAX_DATAGRAM_BYTES = 65536
+
+# How often publishers re-list the directory to pick up workers that started since
+PEER_REFRESH_SECONDS = 5.0
+
+
+class LocalSocketBus:
+    """
+    Pub/sub between the workers on one host over Unix datagram sockets
+    Each worker binds <directory>/<pid>.sock and publishing sends to every peer
+    through one non-blocking sender socket, so a slow peer never stalls the caller
+    """
+
+    def __init__(self, directory: str, peer_refresh_seconds: float = PEER_REFRESH_SECONDS):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{os.getpid()}.sock')
+        self.sock = None
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        self.peer_refresh_seconds = peer_refresh_seconds
+        self.peers: List[str] = []
+        self.peers_listed_at = float('-inf')
+
+    def bind(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.refresh_peers()
+
+    def refresh_peers(self) -> None:
+        self.peers = glob.glob(os.path.join(self.directory, '*.sock'))
+        self.peers_listed_at = time.monotonic()
+
+    def publish(self, channel: str, message) -> None:
+        payload = json.dumps({'channel': channel, 'message': message}).encode('utf-8')
+        if len(payload) > MAX_DATAGRAM_BYTES:
+            # nearby-dirty style id lists can be delivered in parts
+            if isinstance(message, list) and len(message) > 1:
+                half = len(message) // 2
+                self.publish(channel, message[:half])
+                self.publish(channel, message[half:])
+            else:
+                print(f"Error publishing presence message on {channel}: {len(payload)} bytes is too large")
+            return
+
+        if time.monotonic() - self.peers_listed_at > self.peer_refresh_seconds:
+            self.refresh_peers()
+        gone = False
+        for peer in self.peers:
+            try:
+                self.sender.sendto(payload, peer)
+            except BlockingIOError:
+                print(f"Dropped presence message on {channel}: queue to {peer} is full")
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone; clean up its socket file
+                gone = True
+                try:
+                    os.unlink(peer)
+                except FileNotFoundError:
+                    pass
+        if gone:
+            self.refresh_peers()
+
+    def listen(self, deliver: Callable[[str, object], None]) -> None:
+        """
+        Deliver messages from peers until the socket is closed
+        A bad datagram or failing subscriber is logged and skipped
+        """
+        while True:
+            try:
+                payload = self.sock.recv(MAX_DATAGRAM_BYTES)
+                envelope = json.loads(payload)
+                deliver(envelope['channel'], envelope['message'])
+            except Exception as e:
+                if self.sock.fileno() < 0:
+                    return
+                print(f"Error in local presence listener: {str(e)}")
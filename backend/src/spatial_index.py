@@ -0,0 +1,197 @@
+"""
+In-memory spatial grid index for proximity lookups
+Buckets user positions into cells about the size of the proximity radius
+so nearby queries only look at the 3x3 block of cells around a point
+"""
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from geo import EARTH_RADIUS_METERS, within_proximity_mask
+from presence_table import PresenceTable
+
+METERS_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_METERS / 360
+
+# Cells are padded slightly so rounding never pushes a neighbor out of the 3x3 block
+CELL_PADDING = 1.01
+
+# Longitude cells get very wide near the poles, cap the latitude used for sizing them
+MAX_SIZING_LATITUDE = 89.0
+
+# Offsets that keep packed cell ids positive (rows span about +-130k, columns about +-260k)
+CELL_ROW_OFFSET = 1 << 20
+CELL_COL_OFFSET = 1 << 31
+
+Cell = Tuple[int, int]
+
+
+def cell_to_id(cell: Cell) -> int:
+    """
+    Pack a (row, col) cell into a single positive integer (fits in a BIGINT)
+    """
+    row, col = cell
+    return ((row + CELL_ROW_OFFSET) << 32) | (col + CELL_COL_OFFSET)
+
+
+def bounding_box(latitude: float, longitude: float, radius_meters: float) -> Tuple[float, float, float, float]:
+    """
+    Get (min_lat, max_lat, min_lon, max_lon) enclosing a circle around a coordinate
+    """
+    lat_delta = radius_meters / METERS_PER_DEGREE
+    edge = min(abs(latitude) + lat_delta, MAX_SIZING_LATITUDE)
+    lon_delta = radius_meters / (METERS_PER_DEGREE * math.cos(math.radians(edge)))
+    return (latitude - lat_delta, latitude + lat_delta,
+            longitude - lon_delta, longitude + lon_delta)
+
+
+class SpatialGrid:
+    """
+    Uniform latitude rows, each split into longitude columns that are at least
+    cell_size_meters wide anywhere in the row, keyed by (row, col)
+    Positions live in a columnar PresenceTable; cells hold table slots
+    """
+
+    def __init__(self, cell_size_meters: float):
+        self.cell_size_meters = cell_size_meters * CELL_PADDING
+        self.lat_step = self.cell_size_meters / METERS_PER_DEGREE
+        self.table = PresenceTable()
+        self.cells: Dict[Cell, Set[int]] = {}
+        # user_id -> cell
+        self.entries: Dict[int, Cell] = {}
+        self.lock = threading.Lock()
+
+    def _lon_step(self, row: int) -> float:
+        """
+        Longitude width (degrees) of the cells in a row
+        Sized at the most poleward latitude a query touching this row can reach
+        """
+        edge = max(abs(row - 1), abs(row + 2)) * self.lat_step
+        edge = min(edge, MAX_SIZING_LATITUDE)
+        return self.cell_size_meters / (METERS_PER_DEGREE * math.cos(math.radians(edge)))
+
+    def cell_for(self, latitude: float, longitude: float) -> Cell:
+        """
+        Get the (row, col) cell containing a coordinate
+        """
+        row = math.floor(latitude / self.lat_step)
+        col = math.floor(longitude / self._lon_step(row))
+        return (row, col)
+
+    def neighboring_cells(self, latitude: float, longitude: float) -> List[Cell]:
+        """
+        Get the 3x3 block of cells around a coordinate
+        Column indexes are recomputed per row because rows have different widths
+        """
+        row = math.floor(latitude / self.lat_step)
+        cells = []
+        for r in (row - 1, row, row + 1):
+            col = math.floor(longitude / self._lon_step(r))
+            cells.extend((r, c) for c in (col - 1, col, col + 1))
+        return cells
+
+    def update(self, user_id: int, latitude: float, longitude: float,
+               updated_at: Optional[float] = None) -> Cell:
+        """
+        Insert or move a user, only touching cell sets when the cell changes
+        """
+        cell = self.cell_for(latitude, longitude)
+        if updated_at is None:
+            updated_at = time.time()
+
+        with self.lock:
+            slot = self.table.upsert(user_id, latitude, longitude, int(updated_at * 1000))
+            previous = self.entries.get(user_id)
+            if previous is not None and previous != cell:
+                self._discard_from_cell(slot, previous)
+            if previous != cell:
+                self.cells.setdefault(cell, set()).add(slot)
+            self.entries[user_id] = cell
+
+        return cell
+
+    def remove(self, user_id: int) -> bool:
+        """
+        Remove a user from the index
+        Returns True if the user was indexed
+        """
+        with self.lock:
+            previous = self.entries.pop(user_id, None)
+            if previous is None:
+                return False
+            self._discard_from_cell(self.table.slot_of(user_id), previous)
+            self.table.remove(user_id)
+            return True
+
+    def _discard_from_cell(self, slot: int, cell: Cell) -> None:
+        members = self.cells.get(cell)
+        if members is None:
+            return
+        members.discard(slot)
+        if not members:
+            del self.cells[cell]
+
+    def candidate_slots(self, latitude: float, longitude: float) -> np.ndarray:
+        """
+        Get the presence table slots of every user in the 3x3 block around a
+        coordinate; callers still do the exact distance check
+        """
+        with self.lock:
+            found = []
+            for cell in self.neighboring_cells(latitude, longitude):
+                found.extend(self.cells.get(cell, ()))
+        return np.fromiter(found, dtype=np.int64, count=len(found))
+
+    def nearby_positions(self, user_id: int, latitude: float, longitude: float,
+                         stale_seconds: float) -> Dict[int, Tuple[float, float]]:
+        """
+        Get {user_id: (latitude, longitude)} for users updated within stale_seconds
+        and within proximity of a coordinate, excluding user_id
+        """
+        slots = self.candidate_slots(latitude, longitude)
+        if not len(slots):
+            return {}
+
+        table = self.table
+        user_ids = table.user_ids[slots]
+        latitudes = table.latitudes[slots]
+        longitudes = table.longitudes[slots]
+        cutoff_ms = int((time.time() - stale_seconds) * 1000)
+
+        mask = within_proximity_mask(latitude, longitude, latitudes, longitudes, table.cos_latitudes[slots])
+        mask &= (table.updated_at[slots] >= cutoff_ms) & (user_ids != user_id) & (user_ids >= 0)
+
+        return {
+            int(other_id): (float(other_lat), float(other_lon))
+            for other_id, other_lat, other_lon in zip(user_ids[mask], latitudes[mask], longitudes[mask])
+        }
+
+    def fresh_positions(self, user_ids: Iterable[int], stale_seconds: float) -> Dict[int, Tuple[float, float]]:
+        """
+        Get {user_id: (latitude, longitude)} for the users among user_ids updated within stale_seconds
+        """
+        cutoff = time.time() - stale_seconds
+        positions = {}
+        for other_id in user_ids:
+            entry = self.get(other_id)
+            if entry and entry[2] >= cutoff:
+                positions[other_id] = (entry[0], entry[1])
+        return positions
+
+    def get(self, user_id: int) -> Optional[Tuple[float, float, float]]:
+        """
+        Get (latitude, longitude, updated_at) for an indexed user
+        """
+        slot = self.table.slot_of(user_id)
+        if slot is None:
+            return None
+        table = self.table
+        return float(table.latitudes[slot]), float(table.longitudes[slot]), table.updated_at[slot] / 1000
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.entries
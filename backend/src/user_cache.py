@@ -0,0 +1,110 @@
+"""
+Process-level cache of the user fields the location path needs
+Loaded lazily from the users table and kept current by the auth write paths
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+from database import db
+
+# Columns cached per user
+USER_STATE_FIELDS = ('id', 'username', 'avatar_data', 'is_active', 'headline', 'pronouns', 'updated_at')
+
+
+def profile_version(updated_at: Optional[datetime]) -> int:
+    """
+    Version of a user's profile: users.updated_at (naive UTC) in milliseconds
+    Every profile write bumps updated_at, so clients refetch only when this changes
+    """
+    if updated_at is None:
+        return 0
+    return int(updated_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class UserStateCache:
+    """
+    Bounded LRU of user_id -> user state dict
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[int, Dict]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """
+        Get a user's state, loading it from the database on a miss
+        """
+        return self.get_many([user_id]).get(user_id)
+
+    def peek(self, user_id: int) -> Optional[Dict]:
+        """
+        Get a user's state only if it is already cached (never queries)
+        """
+        with self.lock:
+            return self.entries.get(user_id)
+
+    def get_many(self, user_ids: Iterable[int]) -> Dict[int, Dict]:
+        """
+        Get state for many users, loading all misses with a single query
+        Unknown users are left out of the result
+        """
+        found = {}
+        missing = []
+        with self.lock:
+            for user_id in user_ids:
+                state = self.entries.get(user_id)
+                if state is None:
+                    missing.append(user_id)
+                else:
+                    self.entries.move_to_end(user_id)
+                    found[user_id] = state
+
+        if missing:
+            for state in self._load(missing):
+                self.put(state)
+                found[state['id']] = state
+
+        return found
+
+    def _load(self, user_ids: list) -> list:
+        try:
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT {', '.join(USER_STATE_FIELDS)}
+                    FROM users
+                    WHERE id = ANY(%s)
+                """, (user_ids,))
+                return [dict(zip(USER_STATE_FIELDS, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error loading user state: {str(e)}")
+            return []
+
+    def put(self, user: Dict) -> None:
+        """
+        Store a user's state from any row that has the cached columns
+        """
+        state = {field: user[field] for field in USER_STATE_FIELDS}
+        with self.lock:
+            self.entries[state['id']] = state
+            self.entries.move_to_end(state['id'])
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        """
+        Drop a user so the next read reloads them
+        """
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+# Global user state cache
+user_cache = UserStateCache(int(os.getenv('USER_CACHE_SIZE', 10000)))
@@ -0,0 +1,100 @@
+"""
+Compact binary encoding for location traffic
+Negotiated per connection ({'encoding': 'binary'} on location:join);
+other clients keep the JSON format
+
+location:update (client -> server), 16 bytes, little-endian:
+    int32 latitude * 1e7, int32 longitude * 1e7, uint64 timestamp (ms since epoch)
+
+location:nearby-users (server -> client):
+    uint16 count, then per user: uint32 user id, int32 latitude * 1e7, int32 longitude * 1e7
+    Profiles are not repeated; they arrive once per user as JSON in location:profiles
+
+JSON clients can instead ask for positions-only lists ({'mode': 'positions'} on
+location:join): id, coordinates and profile_version per user, with profiles
+fetched from GET /api/users/profiles only when a version changes
+"""
+import struct
+from typing import Dict, List
+
+from nearby_diff import profile_key
+
+COORDINATE_SCALE = 10_000_000
+
+LOCATION_UPDATE = struct.Struct('<iiQ')
+NEARBY_HEADER = struct.Struct('<H')
+NEARBY_RECORD = struct.Struct('<Iii')
+
+
+def encode_location_update(latitude: float, longitude: float, timestamp_ms: int) -> bytes:
+    return LOCATION_UPDATE.pack(round(latitude * COORDINATE_SCALE), round(longitude * COORDINATE_SCALE), timestamp_ms)
+
+
+def decode_location_update(payload: bytes) -> Dict:
+    """
+    Decode a binary location:update into the same dict shape as the JSON event
+    """
+    lat_fixed, lon_fixed, timestamp_ms = LOCATION_UPDATE.unpack(bytes(payload))
+    return {
+        'latitude': lat_fixed / COORDINATE_SCALE,
+        'longitude': lon_fixed / COORDINATE_SCALE,
+        'timestamp': timestamp_ms,
+    }
+
+
+def encode_nearby_users(nearby_users: List[Dict]) -> bytes:
+    """
+    Pack a nearby list into ids and fixed-point coordinates
+    """
+    parts = [NEARBY_HEADER.pack(len(nearby_users))]
+    for user in nearby_users:
+        parts.append(NEARBY_RECORD.pack(
+            user['userId'],
+            round(user['latitude'] * COORDINATE_SCALE),
+            round(user['longitude'] * COORDINATE_SCALE),
+        ))
+    return b''.join(parts)
+
+
+def decode_nearby_users(payload: bytes) -> List[Dict]:
+    (count,) = NEARBY_HEADER.unpack_from(payload)
+    return [
+        {'userId': user_id, 'latitude': lat_fixed / COORDINATE_SCALE, 'longitude': lon_fixed / COORDINATE_SCALE}
+        for user_id, lat_fixed, lon_fixed in NEARBY_RECORD.iter_unpack(payload[NEARBY_HEADER.size:])
+    ][:count]
+
+
+def position_entry(user_id: int, latitude: float, longitude: float, profile_version: int) -> Dict:
+    """
+    Positions-mode entry: id, coordinates and profile version (location:moved sends a list of these)
+    """
+    return {
+        'userId': user_id,
+        'latitude': latitude,
+        'longitude': longitude,
+        'profile_version': profile_version,
+    }
+
+
+def positions_only(nearby_users: List[Dict]) -> List[Dict]:
+    """
+    Strip a nearby list down to ids, coordinates and profile versions
+    """
+    return [
+        position_entry(user['userId'], user['latitude'], user['longitude'], user['profile_version'])
+        for user in nearby_users
+    ]
+
+
+def unsent_profiles(session, nearby_users: List[Dict]) -> List[Dict]:
+    """
+    Get profiles the connection has not received yet (or that changed since)
+    and record them as sent
+    """
+    profiles = []
+    for user in nearby_users:
+        key = profile_key(user)
+        if session.sent_profiles.get(user['userId']) != key:
+            session.sent_profiles[user['userId']] = key
+            profiles.append({field: value for field, value in user.items() if field not in ('latitude', 'longitude')})
+    return profiles
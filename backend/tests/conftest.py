@@ -0,0 +1,88 @@
+import datetime
+import os
+import sys
+import types
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+# Backend modules are flat files in src/ (run the tests from backend/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+# user_id -> users.updated_at served by the fake database (tests may change it)
+FAKE_UPDATED_AT = {}
+
+
+def fake_updated_at(user_id):
+    return FAKE_UPDATED_AT.get(user_id, datetime.datetime(2026, 1, 1))
+
+
+class FakeCursor:
+    rowcount = 0
+
+    def __init__(self, cursor_factory=None):
+        self.dict_rows = cursor_factory is not None
+
+    def execute(self, query, params=None):
+        self.query, self.params = query, params
+
+    def fetchall(self):
+        # Profile lookups (users WHERE id = ANY(...)); every user exists and is active
+        if 'FROM users' in self.query and 'ANY' in self.query:
+            return [(user_id, f'user{user_id}', {}, True, '', None, fake_updated_at(user_id))
+                    for user_id in self.params[0]]
+        return []
+
+    def fetchone(self):
+        if self.dict_rows and 'FROM users WHERE id = %s' in self.query:
+            user_id = self.params[0]
+            return {
+                'id': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@example.com',
+                'headline': '', 'avatar_data': {}, 'pronouns': None, 'is_active': True,
+                'created_at': datetime.datetime(2026, 1, 1), 'updated_at': fake_updated_at(user_id),
+            }
+        return (True,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    closed = 0
+    info = types.SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(cursor_factory)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """
+    The Flask/Socket.IO app, imported once against an in-memory stand-in for Postgres
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('LOCATION_FLUSH_INTERVAL', '0')
+        mp.setenv('BROADCAST_TICK_SECONDS', '0')
+        mp.setenv('INGEST_MIN_INTERVAL_SECONDS', '0.2')
+        mp.setattr(psycopg2, 'connect', lambda **kwargs: FakeConnection())
+        import app
+        import location
+        mp.setattr(location.location_store.writer, 'flush', lambda: 0)
+        yield app
+
+
+@pytest.fixture
+def fake_updated_at_by_user():
+    yield FAKE_UPDATED_AT
+    FAKE_UPDATED_AT.clear()
@@ -0,0 +1,43 @@
+"""
+Per-recipient coalescing in the broadcast scheduler
+"""
+from broadcast_scheduler import BroadcastScheduler
+
+
+def entry(user_id, latitude):
+    return {'userId': user_id, 'latitude': latitude, 'longitude': 0.0, 'profile_version': 1}
+
+
+def scheduler():
+    sent = []
+    return BroadcastScheduler(
+        1.0,
+        lambda user_ids: {user_id: ['list', user_id] for user_id in user_ids},
+        lambda user_id, payload: sent.append(('list', user_id, payload)),
+        lambda user_id, entries: sent.append(('moves', user_id, entries)),
+    ), sent
+
+
+def test_moves_from_many_neighbors_go_out_as_one_message_per_tick():
+    broadcasts, sent = scheduler()
+    for mover in (1, 2, 3):
+        broadcasts.queue_moves([10, 11], entry(mover, 0.1))
+    # The same mover again before the tick: only the latest position is sent
+    broadcasts.queue_moves([10], entry(1, 0.2))
+    assert sent == []
+
+    assert broadcasts.tick() == 2
+    by_recipient = {user_id: entries for kind, user_id, entries in sent}
+    assert len(sent) == 2
+    assert by_recipient[10] == [entry(1, 0.2), entry(2, 0.1), entry(3, 0.1)]
+    assert by_recipient[11] == [entry(1, 0.1), entry(2, 0.1), entry(3, 0.1)]
+    assert broadcasts.tick() == 0
+
+
+def test_recipient_with_a_refreshed_list_gets_no_separate_moves():
+    broadcasts, sent = scheduler()
+    broadcasts.queue_moves([10, 11], entry(1, 0.1))
+    broadcasts.mark_dirty([10])
+
+    assert broadcasts.tick() == 2
+    assert sorted((kind, user_id) for kind, user_id, _ in sent) == [('list', 10), ('moves', 11)]
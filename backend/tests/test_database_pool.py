@@ -0,0 +1,85 @@
+"""
+ConnectionPool checkout limits and bookkeeping (no database needed)
+"""
+import threading
+import time
+import types
+
+import pytest
+from psycopg2 import extensions, pool
+
+import database
+from database import ConnectionPool, PoolQueueFullError, PoolTimeoutError
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = types.SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    monkeypatch.setattr(database.psycopg2, 'connect', lambda **kwargs: FakeConnection())
+
+    def make(maxconn=1, max_waiting=1, timeout=2.0):
+        return ConnectionPool(0, maxconn, timeout=timeout, max_lifetime=3600,
+                              health_check_idle=3600, max_waiting=max_waiting)
+    return make
+
+
+def test_checkout_fails_fast_once_wait_queue_is_full(make_pool):
+    connection_pool = make_pool(maxconn=1, max_waiting=1)
+    held = connection_pool.getconn()
+
+    waiter_got = []
+    waiter = threading.Thread(target=lambda: waiter_got.append(connection_pool.getconn()))
+    waiter.start()
+    while connection_pool.stats()['waiting'] < 1:
+        time.sleep(0.001)
+
+    started = time.monotonic()
+    with pytest.raises(PoolQueueFullError):
+        connection_pool.getconn()
+    assert time.monotonic() - started < 0.5
+    assert connection_pool.stats()['rejected'] == 1
+
+    # The queued caller still gets the connection once it comes back
+    connection_pool.putconn(held)
+    waiter.join(timeout=2)
+    assert waiter_got == [held]
+
+
+def test_queued_checkout_times_out(make_pool):
+    connection_pool = make_pool(maxconn=1, max_waiting=5, timeout=0.05)
+    connection_pool.getconn()
+    with pytest.raises(PoolTimeoutError):
+        connection_pool.getconn()
+    assert connection_pool.stats()['timeouts'] == 1
+
+
+def test_foreign_connections_do_not_change_pool_size(make_pool):
+    connection_pool = make_pool(maxconn=2)
+    conn = connection_pool.getconn()
+    assert connection_pool.stats()['size'] == 1
+
+    with pytest.raises(pool.PoolError):
+        connection_pool.putconn(FakeConnection())
+    connection_pool._discard(FakeConnection())
+    assert connection_pool.stats()['size'] == 1
+    assert connection_pool.stats()['in_use'] == 1
+
+    # A closed connection is discarded on return and can't be returned twice
+    conn.closed = 1
+    connection_pool.putconn(conn)
+    assert connection_pool.stats()['size'] == 0
+    with pytest.raises(pool.PoolError):
+        connection_pool.putconn(conn)
+    assert connection_pool.stats()['size'] == 0
+    assert connection_pool.stats()['in_use'] == 0
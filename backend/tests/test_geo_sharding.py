@@ -0,0 +1,150 @@
+"""
+Geo-sharded presence with in-process shards: border replication, handoff
+between shards and the stale sweep
+"""
+import time
+
+import pytest
+
+from geo import PROXIMITY_RADIUS_METERS
+from geo_sharding import ShardMap, ShardedPresenceBackend
+from presence import LocalPresenceBackend
+from proximity_graph import ProximityGraph
+from spatial_index import SpatialGrid
+
+REGION_DEGREES = 0.01
+METERS_PER_DEGREE_LATITUDE = 111195.0
+STALE_SECONDS = 300
+
+
+class RecordingShard(LocalPresenceBackend):
+    """
+    Local shard that logs writes and can sweep its own stale users like the Redis shard does
+    """
+
+    def __init__(self, name, log):
+        super().__init__(SpatialGrid(PROXIMITY_RADIUS_METERS), ProximityGraph(), STALE_SECONDS)
+        self.loaded = True
+        self.name = name
+        self.log = log
+        self.written = set()
+
+    def update(self, user_id, latitude, longitude):
+        self.log.append(('update', self.name, user_id))
+        self.written.add(user_id)
+        super().update(user_id, latitude, longitude)
+
+    def remove(self, user_id):
+        self.log.append(('remove', self.name, user_id))
+        self.written.discard(user_id)
+        return super().remove(user_id)
+
+    def purge_stale(self, batch_size):
+        stale = sorted(self.written - self.positions(self.written).keys())[:batch_size]
+        return {user_id: self.remove(user_id) for user_id in stale}
+
+
+@pytest.fixture
+def log():
+    return []
+
+
+@pytest.fixture
+def backend(log):
+    shards = [RecordingShard(0, log), RecordingShard(1, log)]
+    graph = LocalPresenceBackend(SpatialGrid(PROXIMITY_RADIUS_METERS), ProximityGraph(), STALE_SECONDS)
+    graph.loaded = True
+    return ShardedPresenceBackend(ShardMap(len(shards), REGION_DEGREES, PROXIMITY_RADIUS_METERS), shards, graph)
+
+
+@pytest.fixture
+def border(backend):
+    """
+    A latitude where the region to the south and the region to the north
+    belong to different shards, plus the longitude to use along it
+    """
+    shard_map = backend.shard_map
+    for row in range(1, 1000):
+        if shard_map.owner_of_region((row - 1, 0)) != shard_map.owner_of_region((row, 0)):
+            return row * REGION_DEGREES, REGION_DEGREES / 2
+    pytest.fail('no border between shards')
+
+
+def north_of(latitude, meters):
+    return latitude + meters / METERS_PER_DEGREE_LATITUDE
+
+
+def move(backend, user_id, latitude, longitude):
+    # Same sequence as location.update_user_location + update_proximity_graph
+    backend.update(user_id, latitude, longitude)
+    positions = backend.nearby_positions(user_id, latitude, longitude)
+    backend.set_neighbors(user_id, positions)
+    return set(positions)
+
+
+def test_shards_for_replicates_only_near_borders(backend, border):
+    latitude, longitude = border
+    shard_map = backend.shard_map
+    south, north = shard_map.owner_of(north_of(latitude, -1), longitude), shard_map.owner_of(north_of(latitude, 1), longitude)
+    assert south != north
+
+    assert shard_map.shards_for(north_of(latitude, -500), longitude) == {south}
+    assert shard_map.shards_for(north_of(latitude, -30), longitude) == {south, north}
+    assert shard_map.shards_for(north_of(latitude, 30), longitude) == {south, north}
+    assert shard_map.shards_for(north_of(latitude, 500), longitude) == {north}
+
+
+def test_query_near_border_finds_users_across_it(backend, border):
+    latitude, longitude = border
+    move(backend, 1, north_of(latitude, -30), longitude)
+    assert move(backend, 2, north_of(latitude, 30), longitude) == {1}
+    assert backend.nearby_positions(1, north_of(latitude, -30), longitude).keys() == {2}
+    assert backend.neighbors(1) == {2}
+
+    # Out of the radius across the border is still out of the radius
+    assert move(backend, 3, north_of(latitude, 120), longitude) == set()
+
+
+def test_user_crossing_shards_keeps_neighbor_set(backend, border, log):
+    latitude, longitude = border
+    south = backend.shard_map.owner_of(north_of(latitude, -1), longitude)
+    north = backend.shard_map.owner_of(north_of(latitude, 1), longitude)
+
+    move(backend, 1, north_of(latitude, -300), longitude)
+    move(backend, 2, north_of(latitude, -330), longitude)
+    assert backend.placement[1] == {south}
+    assert backend.neighbors(1) == {2}
+
+    # Walk north together across the border
+    del log[:]
+    for meters in (-150, -40, 40, 150, 300):
+        move(backend, 2, north_of(latitude, meters - 30), longitude)
+        assert move(backend, 1, north_of(latitude, meters), longitude) == {2}
+        assert backend.neighbors(1) == {2}
+        assert backend.neighbors(2) == {1}
+
+    assert backend.placement[1] == {north}
+    assert backend.shards[south].positions([1, 2]) == {}
+    assert backend.shards[north].positions([1, 2]).keys() == {1, 2}
+
+    # The new shard is written before the old one lets go
+    north_written = log.index(('update', north, 1))
+    south_removed = log.index(('remove', south, 1))
+    assert north_written < south_removed
+
+
+def test_purge_stale_drops_placement_and_edges(backend, border):
+    latitude, longitude = border
+    move(backend, 1, north_of(latitude, -20), longitude)
+    move(backend, 2, north_of(latitude, 20), longitude)
+    assert backend.placement[1] == {0, 1}
+
+    # User 1's worker died: their positions go stale in every shard holding them
+    for shard in backend.shards:
+        shard.spatial_index.update(1, north_of(latitude, -20), longitude, updated_at=time.time() - 2 * STALE_SECONDS)
+
+    assert backend.purge_stale(100) == {1: {2}}
+    assert 1 not in backend.placement
+    assert backend.neighbors(2) == set()
+    assert backend.positions([1]) == {}
+    assert backend.purge_stale(100) == {}
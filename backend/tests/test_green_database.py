@@ -0,0 +1,106 @@
+"""
+Database I/O under eventlet: a slow query must not stall other greenlets
+Each check runs in a fresh interpreter because eventlet monkey patching is global
+"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def run_green(body: str) -> dict:
+    """Run body after monkey patching and importing database; it prints one JSON line"""
+    script = textwrap.dedent('''
+        import eventlet
+        eventlet.monkey_patch()
+        import json, os, sys, time
+        sys.path.insert(0, {src!r})
+        os.environ.setdefault('DB_POOL_MIN', '0')
+        import database
+
+        ticks = [0]
+        running = [True]
+
+        def ticker():
+            # Stands in for socket event handlers sharing the worker
+            while running[0]:
+                ticks[0] += 1
+                eventlet.sleep(0.01)
+    ''').format(src=SRC) + textwrap.dedent(body)
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_wait_callback_yields_while_query_is_pending():
+    result = run_green('''
+        import psycopg2
+        from psycopg2 import extensions
+        original_socket = eventlet.patcher.original('socket')
+        original_threading = eventlet.patcher.original('threading')
+        original_time = eventlet.patcher.original('time')
+
+        class SlowGreenConnection:
+            """Answers after delay seconds from a real OS thread, the way Postgres would"""
+
+            def __init__(self, delay):
+                self.reader, writer = original_socket.socketpair()
+                self.reader.setblocking(False)
+
+                def answer():
+                    original_time.sleep(delay)
+                    writer.send(b'x')
+
+                original_threading.Thread(target=answer, daemon=True).start()
+
+            def fileno(self):
+                return self.reader.fileno()
+
+            def poll(self):
+                try:
+                    self.reader.recv(1)
+                    return extensions.POLL_OK
+                except BlockingIOError:
+                    return extensions.POLL_READ
+
+        installed = extensions.get_wait_callback() is database.eventlet_wait_callback
+        eventlet.spawn(ticker)
+        eventlet.sleep(0)
+        started = time.monotonic()
+        database.eventlet_wait_callback(SlowGreenConnection(0.3))
+        elapsed = time.monotonic() - started
+        running[0] = False
+        print(json.dumps({'installed': installed, 'ticks': ticks[0], 'elapsed': elapsed}))
+    ''')
+    assert result['installed']
+    assert result['elapsed'] >= 0.3
+    # ~30 ticks at 10ms; a blocking wait would allow none
+    assert result['ticks'] >= 10
+
+
+def test_pg_sleep_does_not_block_other_greenlets():
+    result = run_green('''
+        try:
+            conn = database.db.get_connection()
+        except Exception as e:
+            print(json.dumps({'skip': str(e)}))
+            sys.exit(0)
+        eventlet.spawn(ticker)
+        eventlet.sleep(0)
+        started = time.monotonic()
+        cursor = conn.cursor()
+        cursor.execute('SELECT pg_sleep(0.3)')
+        elapsed = time.monotonic() - started
+        running[0] = False
+        database.db.return_connection(conn)
+        print(json.dumps({'ticks': ticks[0], 'elapsed': elapsed}))
+    ''')
+    if 'skip' in result:
+        pytest.skip(f"database not reachable: {result['skip']}")
+    assert result['elapsed'] >= 0.3
+    assert result['ticks'] >= 10
@@ -0,0 +1,103 @@
+"""
+location:moved reach, and location state kept up to date from background tasks
+Runs the Socket.IO handlers through Flask-SocketIO's test client against an
+in-memory stand-in for Postgres
+"""
+import time
+
+import pytest
+
+
+def connect(app_module, user_id, mode=None):
+    from auth import generate_jwt_token
+    client = app_module.socketio.test_client(app_module.app, auth={'token': generate_jwt_token(user_id)})
+    client.emit('location:join', {'mode': mode} if mode else {})
+    client.get_received()
+    return client
+
+
+def received(client, name):
+    return [message['args'][0] for message in client.get_received() if message['name'] == name]
+
+
+def nearby_ids(payload):
+    return sorted(user['userId'] for user in payload)
+
+
+def wait_for_interval(app_module):
+    # Let the ingest interval pass (and any deferred update run)
+    app_module.socketio.sleep(0.3)
+
+
+def test_moved_reaches_only_positions_mode_neighbors_in_radius(app_module):
+    mover = connect(app_module, 101, 'positions')
+    neighbor = connect(app_module, 102, 'positions')
+    full_neighbor = connect(app_module, 103)
+    distant = connect(app_module, 104, 'positions')
+
+    neighbor.emit('location:update', {'latitude': 10.0003, 'longitude': 20.0})
+    full_neighbor.emit('location:update', {'latitude': 10.0, 'longitude': 20.0003})
+    # ~130 m north: in the next cell over, but outside the radius
+    distant.emit('location:update', {'latitude': 10.0012, 'longitude': 20.0})
+    mover.emit('location:update', {'latitude': 10.0, 'longitude': 20.0})
+    wait_for_interval(app_module)
+    for client in (mover, neighbor, full_neighbor, distant):
+        client.get_received()
+
+    mover.emit('location:update', {'latitude': 10.00005, 'longitude': 20.0})
+
+    batches = received(neighbor, 'location:moved')
+    assert len(batches) == 1
+    [entry] = batches[0]
+    assert entry['userId'] == 101
+    assert entry['latitude'] == pytest.approx(10.00005)
+    assert set(entry) == {'userId', 'latitude', 'longitude', 'profile_version'}
+
+    assert received(distant, 'location:moved') == []
+    full_messages = full_neighbor.get_received()
+    assert [m for m in full_messages if m['name'] == 'location:moved'] == []
+    assert len([m for m in full_messages if m['name'] == 'location:nearby-users']) == 1
+
+
+def test_expiry_outside_request_context_clears_graph_and_neighbors(app_module):
+    from location import presence, spatial_index
+
+    expiring = connect(app_module, 201)
+    neighbor = connect(app_module, 202)
+    expiring.emit('location:update', {'latitude': 30.0, 'longitude': 40.0})
+    neighbor.emit('location:update', {'latitude': 30.0003, 'longitude': 40.0})
+    assert presence.neighbors(202) == {201}
+    neighbor.get_received()
+
+    session = app_module.sessions.for_user(201)
+    assert session.cell is not None
+    # Age the position past the stale cutoff, then run maintenance from outside any request
+    spatial_index.update(201, 30.0, 40.0, updated_at=time.time() - 1000)
+    app_module.maintenance_scheduler.tick(now=time.time() + 400)
+
+    assert session.cell is None
+    assert spatial_index.get(201) is None
+    assert presence.neighbors(202) == set()
+    assert [nearby_ids(payload) for payload in received(neighbor, 'location:nearby-users')] == [[]]
+
+
+def test_deferred_update_changes_cell_and_updates_graph(app_module):
+    from location import presence
+
+    mover = connect(app_module, 301)
+    neighbor = connect(app_module, 302)
+    # ~110 m from the mover's first fix, next to its second (a different cell)
+    neighbor.emit('location:update', {'latitude': 50.001, 'longitude': 60.0})
+    mover.emit('location:update', {'latitude': 50.0, 'longitude': 60.0})
+    first_cell = app_module.sessions.for_user(301).cell
+    neighbor.get_received()
+
+    # Inside the ingest interval, so this one is applied by a background task
+    mover.emit('location:update', {'latitude': 50.0009, 'longitude': 60.0})
+    assert presence.positions([301])[301] == pytest.approx((50.0, 60.0))
+    wait_for_interval(app_module)
+
+    assert presence.positions([301])[301] == pytest.approx((50.0009, 60.0))
+    assert app_module.sessions.for_user(301).cell != first_cell
+    assert presence.neighbors(302) == {301}
+    assert [nearby_ids(payload) for payload in received(neighbor, 'location:nearby-users')] == [[301]]
@@ -0,0 +1,80 @@
+"""
+Vectorized proximity math and the columnar presence table
+"""
+import numpy as np
+
+from geo import (PROXIMITY_RADIUS_METERS, calculate_distance, calculate_distance_many,
+                 is_within_proximity, within_proximity_mask)
+from presence_table import PresenceTable
+
+
+def random_points(rng, count, center_lat, center_lon, spread_meters):
+    """Points scattered around a center, spread_meters in each direction"""
+    degrees = spread_meters / 111_195
+    latitudes = center_lat + rng.uniform(-degrees, degrees, count)
+    longitudes = center_lon + rng.uniform(-degrees, degrees, count) / np.cos(np.radians(center_lat))
+    return latitudes, longitudes
+
+
+def test_vectorized_distances_match_scalar():
+    rng = np.random.default_rng(3)
+    for center_lat, center_lon in [(37.77, -122.42), (-33.87, 151.21), (64.15, -21.94), (0.0, 179.999)]:
+        latitudes, longitudes = random_points(rng, 500, center_lat, center_lon, 3 * PROXIMITY_RADIUS_METERS)
+        lat, lon = center_lat + rng.uniform(-1e-4, 1e-4), center_lon + rng.uniform(-1e-4, 1e-4)
+
+        expected = np.array([calculate_distance(lat, lon, other_lat, other_lon)
+                             for other_lat, other_lon in zip(latitudes, longitudes)])
+        np.testing.assert_allclose(calculate_distance_many(lat, lon, latitudes, longitudes), expected,
+                                   rtol=1e-9, atol=1e-6)
+
+
+def test_mask_matches_scalar_with_precomputed_cosines():
+    rng = np.random.default_rng(11)
+    table = PresenceTable(capacity=16)
+    latitudes, longitudes = random_points(rng, 2000, 40.71, -74.0, 2 * PROXIMITY_RADIUS_METERS)
+    for user_id, (latitude, longitude) in enumerate(zip(latitudes, longitudes), start=1):
+        table.upsert(user_id, latitude, longitude, 0)
+
+    slots = table.occupied_slots()
+    lat, lon = 40.71, -74.0
+    mask = within_proximity_mask(lat, lon, table.latitudes[slots], table.longitudes[slots],
+                                 table.cos_latitudes[slots])
+    expected = np.array([is_within_proximity(lat, lon, other_lat, other_lon)
+                         for other_lat, other_lon in zip(table.latitudes[slots], table.longitudes[slots])])
+
+    # Points sitting on the radius may round either way
+    distances = calculate_distance_many(lat, lon, table.latitudes[slots], table.longitudes[slots])
+    decisive = np.abs(distances - PROXIMITY_RADIUS_METERS) > 1e-6
+    assert mask.any() and (~mask).any()
+    assert np.array_equal(mask[decisive], expected[decisive])
+
+
+def test_memory_footprint_at_10k_users():
+    table = PresenceTable()
+    rng = np.random.default_rng(7)
+    latitudes, longitudes = random_points(rng, 10_000, 37.77, -122.42, 5_000)
+    for user_id, (latitude, longitude) in enumerate(zip(latitudes, longitudes), start=1):
+        table.upsert(user_id, latitude, longitude, 0)
+
+    footprint = table.memory_footprint(10_000)
+    print(f"presence table at 10k users: {footprint}")
+
+    # Five 8-byte columns per user
+    assert footprint['columns_bytes'] == 10_000 * 5 * 8
+    allocated = sum(column.nbytes for column in
+                    (table.user_ids, table.latitudes, table.longitudes, table.cos_latitudes, table.updated_at))
+    assert footprint['columns_bytes'] <= allocated < 2 * footprint['columns_bytes']
+    assert footprint['total_bytes'] == footprint['columns_bytes'] + footprint['index_bytes']
+    # Columns plus the slot dict stay well under the per-user dict rows they replace
+    assert footprint['total_bytes'] < 3_000_000
+
+
+def test_freed_slots_are_reused_before_growing():
+    table = PresenceTable(capacity=4)
+    for user_id in range(1, 5):
+        table.upsert(user_id, 1.0, 2.0, 0)
+    table.remove(2)
+    table.upsert(9, 3.0, 4.0, 0)
+    assert table.capacity == 4
+    assert table.user_ids[table.slot_of(9)] == 9
+    assert 2 not in table and len(table) == 4
@@ -0,0 +1,71 @@
+"""
+Profile routes: bulk lookups only serve users the caller can see nearby, and
+conditional GETs of the caller's own profile
+"""
+import datetime
+
+
+
+def token(user_id):
+    # Imported late so the app fixture has patched the database first
+    from auth import generate_jwt_token
+    return generate_jwt_token(user_id)
+
+
+def connect(app_module, user_id):
+    client = app_module.socketio.test_client(app_module.app, auth={'token': token(user_id)})
+    client.emit('location:join', {'mode': 'positions'})
+    return client
+
+
+def fetch_profiles(app_module, user_id, ids):
+    client = app_module.app.test_client()
+    return client.get(
+        f"/api/users/profiles?ids={','.join(map(str, ids))}",
+        headers={'Authorization': f'Bearer {token(user_id)}'},
+    )
+
+
+def test_profiles_are_limited_to_neighbors(app_module):
+    requester = connect(app_module, 401)
+    neighbor = connect(app_module, 402)
+    far_away = connect(app_module, 403)
+    requester.emit('location:update', {'latitude': 70.0, 'longitude': 10.0})
+    neighbor.emit('location:update', {'latitude': 70.0003, 'longitude': 10.0})
+    far_away.emit('location:update', {'latitude': 70.01, 'longitude': 10.0})
+
+    response = fetch_profiles(app_module, 401, [402, 403, 404])
+    assert response.status_code == 200
+    assert [profile['userId'] for profile in response.get_json()['profiles']] == [402]
+
+    # Nobody nearby: only the caller's own profile is visible
+    response = fetch_profiles(app_module, 403, [401, 402, 403])
+    assert [profile['userId'] for profile in response.get_json()['profiles']] == [403]
+
+    for client in (requester, neighbor, far_away):
+        client.disconnect()
+
+
+def get_own_profile(app_module, user_id, **headers):
+    headers['Authorization'] = f'Bearer {token(user_id)}'
+    return app_module.app.test_client().get('/api/auth/profile', headers=headers)
+
+
+def test_same_second_edit_is_not_hidden_by_if_modified_since(app_module, fake_updated_at_by_user):
+    from user_cache import user_cache
+
+    fake_updated_at_by_user[501] = datetime.datetime(2026, 3, 1, 12, 0, 0, 200000)
+    first = get_own_profile(app_module, 501)
+    assert first.status_code == 200
+    assert first.headers['Last-Modified'] == 'Sun, 01 Mar 2026 12:00:00 GMT'
+    assert get_own_profile(app_module, 501, **{'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    # Edited again 500 ms later: same Last-Modified second, new version
+    fake_updated_at_by_user[501] = datetime.datetime(2026, 3, 1, 12, 0, 0, 700000)
+    user_cache.invalidate(501)
+    second = get_own_profile(app_module, 501, **{'If-Modified-Since': first.headers['Last-Modified']})
+    assert second.status_code == 200
+    assert second.get_json()['user']['profile_version'] != first.get_json()['user']['profile_version']
+
+    assert get_own_profile(app_module, 501, **{'If-None-Match': first.headers['ETag']}).status_code == 200
+    assert get_own_profile(app_module, 501, **{'If-None-Match': second.headers['ETag']}).status_code == 304
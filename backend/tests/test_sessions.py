@@ -0,0 +1,31 @@
+"""
+Session registry bookkeeping for users with several sockets
+"""
+from sessions import SessionRegistry
+
+
+def test_user_stays_mapped_until_last_socket_disconnects():
+    registry = SessionRegistry()
+    older = registry.create('sid-old', 7, is_active=True)
+    newer = registry.create('sid-new', 7, is_active=True)
+    assert registry.for_user(7) is newer
+
+    # Newest socket goes first; the older one still counts as connected
+    assert registry.remove('sid-new') is newer
+    assert registry.for_user(7) is older
+
+    assert registry.remove('sid-old') is older
+    assert registry.for_user(7) is None
+    assert registry.remove('sid-old') is None
+    assert len(registry) == 0
+
+
+def test_oldest_socket_leaving_keeps_newest_as_current():
+    registry = SessionRegistry()
+    registry.create('a', 1)
+    newer = registry.create('b', 1)
+    registry.create('c', 2)
+
+    registry.remove('a')
+    assert registry.for_user(1) is newer
+    assert registry.for_user(2).sid == 'c'
@@ -0,0 +1,159 @@
+"""
+Cell-bucketed shared presence segment and the shm presence backend
+"""
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from geo import PROXIMITY_RADIUS_METERS, calculate_distance
+from presence import SharedMemoryPresenceBackend
+from shared_presence import LocalSocketBus, SharedPresenceSegment
+from spatial_index import SpatialGrid, cell_to_id
+
+
+@pytest.fixture
+def segment_path(tmp_path):
+    return str(tmp_path / 'presence')
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def test_second_mapping_sees_writes_moves_and_clears(segment_path):
+    grid = SpatialGrid(PROXIMITY_RADIUS_METERS)
+    writer = SharedPresenceSegment(segment_path, 1024, bucket_slots=16)
+    reader = SharedPresenceSegment(segment_path, 1024, bucket_slots=16)
+
+    cell = cell_to_id(grid.cell_for(37.0, -122.0))
+    assert writer.write(7, 37.0, -122.0, now_ms(), cell, 0)
+    assert [int(user_id) for user_id in reader.in_cells([cell], 0)['user_id']] == [7]
+
+    # Move far enough to land in another cell (and most likely another bucket)
+    far_cell = cell_to_id(grid.cell_for(37.5, -122.0))
+    assert writer.write(7, 37.5, -122.0, now_ms(), far_cell, 0)
+    assert len(reader.in_cells([cell], 0)) == 0
+    row = reader.read([7])
+    assert len(row) == 1 and row['latitude'][0] == 37.5 and row['cell_id'][0] == far_cell
+
+    writer.clear(7)
+    assert len(reader.read([7])) == 0
+    assert len(reader.in_cells([far_cell], 0)) == 0
+
+
+def test_full_bucket_spills_into_the_next_one(segment_path):
+    segment = SharedPresenceSegment(segment_path, 64, bucket_slots=4)
+    cell = 12345
+    for user_id in range(1, 11):
+        assert segment.write(user_id, 1.0, 2.0, now_ms(), cell, 0)
+    assert segment.spill[segment.bucket_of_cell(cell)] >= 2
+    assert sorted(int(user_id) for user_id in segment.in_cells([cell], 0)['user_id']) == list(range(1, 11))
+
+
+def test_stale_records_are_reclaimed(segment_path):
+    segment = SharedPresenceSegment(segment_path, 4, bucket_slots=4)
+    for user_id in range(1, 5):
+        assert segment.write(user_id, 1.0, 2.0, 1000, 99, 0)
+    assert segment.write(5, 1.0, 2.0, 5000, 99, 2000)
+    assert 5 in set(int(user_id) for user_id in segment.in_cells([99], 0)['user_id'])
+    # The evicted user is gone from the directory too
+    assert len(segment.read([1, 2, 3, 4])) == 3
+
+
+def test_lookup_reads_only_the_neighborhood_buckets(segment_path):
+    grid = SpatialGrid(PROXIMITY_RADIUS_METERS)
+    segment = SharedPresenceSegment(segment_path, 65536, bucket_slots=256)
+    cell_ids = [cell_to_id(cell) for cell in grid.neighboring_cells(37.0, -122.0)]
+    buckets = set()
+    for cell_id in cell_ids:
+        buckets.update(segment._bucket_range(segment.bucket_of_cell(cell_id)))
+    assert len(segment._slots_of_buckets(sorted(buckets))) <= 9 * 256
+
+
+def test_backend_matches_brute_force(segment_path):
+    grid = SpatialGrid(PROXIMITY_RADIUS_METERS)
+    backend = SharedMemoryPresenceBackend(grid, segment_path, 8192, stale_seconds=300, bucket_slots=64)
+    rng = np.random.default_rng(5)
+    degrees = 400 / 111_195
+    users = {
+        user_id: (37.0 + rng.uniform(-degrees, degrees), -122.0 + rng.uniform(-degrees, degrees) * 1.25)
+        for user_id in range(1, 301)
+    }
+    for user_id, (latitude, longitude) in users.items():
+        backend.update(user_id, latitude, longitude)
+
+    def brute_force(user_id):
+        latitude, longitude = users[user_id]
+        return {
+            other_id for other_id, (other_lat, other_lon) in users.items()
+            if other_id != user_id and calculate_distance(latitude, longitude, other_lat, other_lon) <= PROXIMITY_RADIUS_METERS
+        }
+
+    batched = backend.neighbors_many(users)
+    for user_id in users:
+        assert batched[user_id] == brute_force(user_id)
+        assert set(backend.nearby_positions(user_id, *users[user_id])) == brute_force(user_id)
+    assert backend.neighbors(10_000) == set()
+
+
+def listening_bus(directory):
+    bus = LocalSocketBus(str(directory))
+    bus.bind()
+    received = []
+
+    def deliver(channel, message):
+        if channel == 'boom':
+            raise RuntimeError('subscriber failed')
+        received.append((channel, message))
+
+    threading.Thread(target=bus.listen, args=(deliver,), daemon=True).start()
+    return bus, received
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_bus_listener_survives_bad_datagrams_and_failing_subscribers(tmp_path):
+    bus, received = listening_bus(tmp_path)
+    raw = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    raw.sendto(b'{not json', bus.path)
+    bus.publish('boom', 1)
+    bus.publish('user-changed', 7)
+    assert wait_until(lambda: received == [('user-changed', 7)])
+    bus.sock.close()
+
+
+def test_bus_splits_oversized_lists(tmp_path):
+    bus, received = listening_bus(tmp_path)
+    user_ids = list(range(1_000_000, 1_020_000))
+    bus.publish('nearby-dirty', user_ids)
+    assert wait_until(lambda: sum(len(message) for _, message in received) == len(user_ids))
+    assert len(received) > 1
+    assert sorted(sum((message for _, message in received), [])) == user_ids
+    bus.sock.close()
+
+
+def test_bus_drops_instead_of_blocking_on_full_peer_and_forgets_dead_ones(tmp_path):
+    bus = LocalSocketBus(str(tmp_path))
+    bus.bind()
+    stuck = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    stuck.bind(str(tmp_path / 'stuck.sock'))
+    dead = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    dead.bind(str(tmp_path / 'dead.sock'))
+    dead.close()
+    bus.refresh_peers()
+
+    started = time.monotonic()
+    for _ in range(5000):
+        bus.publish('user-changed', 7)
+    assert time.monotonic() - started < 5
+    assert not (tmp_path / 'dead.sock').exists()
+    assert str(tmp_path / 'dead.sock') not in bus.peers
+    assert str(tmp_path / 'stuck.sock') in bus.peers